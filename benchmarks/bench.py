@@ -0,0 +1,266 @@
+# Showsho
+# Copyright (C) 2015-2016  Dino Duratović <dinomol at mail dot com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Benchmark showsho against a local TVMaze stand-in.
+
+Starts server.py and then, for every list size, a fresh Python process
+with an empty cache directory which runs these phases on a list of
+"Show 1" to "Show N":
+
+    update    update_shows() with nothing cached
+    refresh   update_shows() again, with conditional requests
+    load      get_shows() from the cache store
+    snapshot  snapshot.write() and reading the shows back from it
+    print     format_shows() (parses the lazily loaded dates)
+
+For every phase it reports the wall time, the throughput in shows per
+second, the p50 and p99 latency per show (per request for the update
+phases, from sending it to parsing the response, without the time
+spent waiting for a free connection) and the peak RSS of the process
+so far. The rate limiter is
+disabled unless --rate-limit is given, so the numbers show showsho's
+own costs.
+
+    python3 benchmarks/bench.py [--shows 10,100,1000] [--jobs 8] ...
+
+--json prints the results as JSON lines instead of a table.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVER = os.path.join(ROOT, "benchmarks", "server.py")
+
+def get_percentile(values, percentile):
+    """Return the value below which "percentile" % of the values are."""
+    if not values:
+        return 0
+    values = sorted(values)
+    index = round(percentile / 100 * (len(values) - 1))
+    return values[index]
+
+def get_peak_rss():
+    """Return the process' peak resident set size in KiB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        # bytes on macOS
+        peak //= 1024
+    return peak
+
+def get_result(count, phase, seconds, latencies):
+    """Return a dictionary with a phase's results."""
+    return {
+        "shows": count,
+        "phase": phase,
+        "seconds": round(seconds, 4),
+        "throughput": round(count / seconds, 1) if seconds else None,
+        "p50_ms": round(get_percentile(latencies, 50) * 1000, 3),
+        "p99_ms": round(get_percentile(latencies, 99) * 1000, 3),
+        "peak_rss_kib": get_peak_rss()
+        }
+
+def measure(count, port, jobs, rate_limit):
+    """Run the phases for a list of "count" shows, return the results.
+
+    Runs in its own process (see main()), so the peak RSS is only that
+    of this list size.
+    """
+    sys.path.insert(0, ROOT)
+    import showsho
+    from showsho import cache
+    from showsho import fetch
+    from showsho import show
+    from showsho import snapshot
+    from showsho import utils
+
+    show.API_URL = "http://127.0.0.1:{}".format(port)
+    if rate_limit:
+        fetch.client = fetch.Client(rate=rate_limit)
+    else:
+        fetch.client = fetch.Client(rate=1e9, burst=1e9)
+
+    # the time of every request sent over a connection
+    request_times = []
+    request = fetch.request
+    def timed_request(*args):
+        start = time.perf_counter()
+        try:
+            return request(*args)
+        finally:
+            request_times.append(time.perf_counter() - start)
+    fetch.request = timed_request
+
+    results = []
+    with tempfile.TemporaryDirectory() as cache_directory:
+        file_path = os.path.join(cache_directory, "shows.txt")
+        with open(file_path, "w") as file_:
+            for number in range(1, count + 1):
+                file_.write("Show {}\n".format(number))
+        titles = utils.get_lines_from_file(file_path)
+        store = cache.open_store(cache_directory)
+
+        # update_shows() prints its progress
+        with contextlib.redirect_stdout(io.StringIO()):
+            for phase in ["update", "refresh"]:
+                shows, new_shows = showsho.get_shows(file_path, store)
+                del request_times[:]
+                start = time.perf_counter()
+                showsho.update_shows(shows, store, jobs)
+                seconds = time.perf_counter() - start
+                results.append(
+                    get_result(count, phase, seconds, request_times)
+                    )
+
+        start = time.perf_counter()
+        shows, new_shows = showsho.get_shows(file_path, store)
+        seconds = time.perf_counter() - start
+        latencies = []
+        for title in titles:
+            show_start = time.perf_counter()
+            utils.show_from_data(title, store.get(title))
+            latencies.append(time.perf_counter() - show_start)
+        results.append(get_result(count, "load", seconds, latencies))
+
+        snapshot_path = os.path.join(cache_directory, "shows.snap")
+        start = time.perf_counter()
+        snapshot.write(snapshot_path, shows, store.get_version())
+        cached_snapshot = snapshot.load(snapshot_path, store.get_version())
+        latencies = []
+        for index in range(len(cached_snapshot)):
+            show_start = time.perf_counter()
+            cached_snapshot.get_show(index)
+            latencies.append(time.perf_counter() - show_start)
+        seconds = time.perf_counter() - start
+        results.append(get_result(count, "snapshot", seconds, latencies))
+
+        start = time.perf_counter()
+        showsho.format_shows(shows, False)
+        seconds = time.perf_counter() - start
+        latencies = []
+        for s in showsho.get_shows(file_path, store)[0]:
+            show_start = time.perf_counter()
+            utils.pretty_status(s, show.Show.padding)
+            latencies.append(time.perf_counter() - show_start)
+        results.append(get_result(count, "print", seconds, latencies))
+
+    return results
+
+def start_server(arguments):
+    """Start server.py and wait until it accepts connections."""
+    server = subprocess.Popen([
+        sys.executable,
+        SERVER,
+        "--port", str(arguments.port),
+        "--seasons", str(arguments.seasons),
+        "--episodes", str(arguments.episodes),
+        "--summary", str(arguments.summary),
+        "--latency", str(arguments.latency),
+        "--rate", str(arguments.rate)
+        ])
+    for attempt in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", arguments.port)).close()
+            return server
+        except OSError:
+            time.sleep(0.05)
+    server.kill()
+    raise RuntimeError("The server didn't start")
+
+def print_table(results):
+    print("{:>7} {:<9} {:>9} {:>9} {:>9} {:>9} {:>10}".format(
+        "shows", "phase", "seconds", "shows/s", "p50 ms", "p99 ms", "RSS MiB"
+        ))
+    for result in results:
+        print("{:>7} {:<9} {:>9.3f} {:>9} {:>9.3f} {:>9.3f} {:>10.1f}".format(
+            result["shows"],
+            result["phase"],
+            result["seconds"],
+            result["throughput"] or "-",
+            result["p50_ms"],
+            result["p99_ms"],
+            result["peak_rss_kib"] / 1024
+            ))
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark showsho against a local TVMaze stand-in."
+        )
+    parser.add_argument("--shows", default="10,100,1000",
+                        help="comma separated list sizes")
+    parser.add_argument("-j", "--jobs", type=int, default=8,
+                        help="concurrent requests")
+    parser.add_argument("--rate-limit", type=float, default=0,
+                        help="requests per second (0 disables the limit)")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--seasons", type=int, default=5)
+    parser.add_argument("--episodes", type=int, default=20,
+                        help="episodes per season")
+    parser.add_argument("--summary", type=int, default=400,
+                        help="bytes of unused text per episode")
+    parser.add_argument("--latency", type=float, default=0,
+                        help="seconds every response is delayed")
+    parser.add_argument("--rate", type=float, default=0,
+                        help="fraction of requests answered with 429")
+    parser.add_argument("--json", action="store_true",
+                        help="print JSON lines instead of a table")
+    parser.add_argument("--measure", type=int, help=argparse.SUPPRESS)
+    arguments = parser.parse_args()
+
+    if arguments.measure:
+        results = measure(
+            arguments.measure,
+            arguments.port,
+            arguments.jobs,
+            arguments.rate_limit
+            )
+        print(json.dumps(results))
+        return
+
+    server = start_server(arguments)
+    results = []
+    try:
+        for count in arguments.shows.split(","):
+            output = subprocess.run([
+                sys.executable,
+                __file__,
+                "--measure", count,
+                "--port", str(arguments.port),
+                "--jobs", str(arguments.jobs),
+                "--rate-limit", str(arguments.rate_limit)
+                ], stdout=subprocess.PIPE, check=True).stdout
+            results.extend(json.loads(output))
+    finally:
+        server.terminate()
+        server.wait()
+
+    if arguments.json:
+        for result in results:
+            print(json.dumps(result))
+    else:
+        print_table(results)
+
+if __name__ == "__main__":
+    main()
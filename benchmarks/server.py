@@ -0,0 +1,215 @@
+# Showsho
+# Copyright (C) 2015-2016  Dino Duratović <dinomol at mail dot com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Local stand-in for the TVMaze API, used by bench.py.
+
+Serves synthetic shows named "Show 1", "Show 2", ... whose ID is their
+number, with the endpoints showsho uses: "singlesearch" and "shows"
+(with embedded seasons and episodes), the episodes of a season and
+"updates". Every show has the same shape: "seasons" seasons of
+"episodes" episodes, one a week, with the last season airing now.
+Each episode has a summary of "summary" bytes, like the real API's
+summaries, images and links that showsho doesn't use.
+
+Every response is delayed by "latency" seconds and a "rate" fraction
+of the requests gets a "429 Too Many Requests". Responses are gzip
+compressed if the client accepts it and have an ETag, so conditional
+requests get a "304 Not Modified".
+
+    python3 benchmarks/server.py [--port PORT] [--latency SECONDS] ...
+"""
+
+import argparse
+import datetime
+import functools
+import gzip
+import http.server
+import json
+import random
+import re
+import time
+import urllib.parse
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # the headers and the body are written separately, with Nagle's
+    # algorithm the body would wait for the client's delayed ACK
+    disable_nagle_algorithm = True
+
+    def log_message(self, format_, *args):
+        pass
+
+    def send_json(self, status, body, etag=None):
+        if etag and self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        encoding = self.headers.get("Accept-Encoding") or ""
+        if "gzip" in encoding and self.server.compress:
+            body = gzip.compress(body, compresslevel=1)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        if "gzip" in encoding and self.server.compress:
+            self.send_header("Content-Encoding", "gzip")
+        if etag:
+            self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if random.random() < self.server.rate:
+            self.send_response(429)
+            self.send_header("Retry-After", "0")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        parts = urllib.parse.urlsplit(self.path)
+        query = urllib.parse.parse_qs(parts.query)
+        embeds = tuple(query.get("embed[]", []))
+
+        show_id = None
+        if parts.path == "/singlesearch/shows":
+            title = query.get("q", [""])[0].lower()
+            match = re.fullmatch(r"show (\d+)", title)
+            if match:
+                show_id = int(match.group(1))
+        match = re.fullmatch(r"/shows/(\d+)", parts.path)
+        if match:
+            show_id = int(match.group(1))
+        if show_id:
+            self.send_json(
+                200,
+                self.server.get_show(show_id, embeds),
+                '"{}-{}"'.format(show_id, ",".join(embeds))
+                )
+            return
+
+        match = re.fullmatch(r"/seasons/(\d+)/episodes", parts.path)
+        if match:
+            season_id = int(match.group(1))
+            self.send_json(
+                200,
+                self.server.get_episodes(season_id),
+                '"season-{}"'.format(season_id)
+                )
+            return
+
+        if parts.path == "/updates/shows":
+            self.send_json(200, b"{}")
+            return
+
+        self.send_json(404, b'{"status": 404}')
+
+class Server(http.server.ThreadingHTTPServer):
+    """HTTP server with the synthetic shows, see the module docstring."""
+    daemon_threads = True
+
+    def __init__(self, address, seasons=5, episodes=20, summary=400,
+                 latency=0, rate=0, compress=True):
+        super().__init__(address, Handler)
+        self.seasons = seasons
+        self.episodes = episodes
+        self.summary = summary
+        self.latency = latency
+        self.rate = rate
+        self.compress = compress
+        self.today = datetime.date.today()
+
+    def make_episodes(self, show_id, season):
+        """Return a list with a season's episodes."""
+        # the last season started half way through its episodes
+        start = self.today - datetime.timedelta(
+            weeks=(self.seasons - season) * 52 + self.episodes // 2
+            )
+        return [{
+            "id": show_id * 100000 + season * 1000 + number,
+            "url": "http://localhost/episodes/{}".format(number),
+            "name": "Episode {}".format(number),
+            "season": season,
+            "number": number,
+            "airdate": (
+                start + datetime.timedelta(weeks=number - 1)).isoformat(),
+            "airtime": "21:00",
+            "runtime": 60,
+            "image": {"medium": "http://localhost/image.jpg"},
+            "summary": "<p>{}</p>".format("x" * self.summary),
+            "_links": {"self": {"href": "http://localhost/"}}
+            } for number in range(1, self.episodes + 1)]
+
+    @functools.lru_cache(maxsize=1024)
+    def get_show(self, show_id, embeds):
+        """Return the show's JSON body with the embedded resources."""
+        episodes = [
+            self.make_episodes(show_id, season)
+            for season in range(1, self.seasons + 1)
+            ]
+        embedded = {}
+        if "seasons" in embeds:
+            embedded["seasons"] = [{
+                "id": show_id * 1000 + season,
+                "number": season,
+                "premiereDate": season_episodes[0]["airdate"],
+                "endDate": season_episodes[-1]["airdate"],
+                "episodeOrder": len(season_episodes)
+                } for season, season_episodes in enumerate(episodes, 1)]
+        if "episodes" in embeds:
+            embedded["episodes"] = [e for season in episodes for e in season]
+        return json.dumps({
+            "id": show_id,
+            "name": "Show {}".format(show_id),
+            "updated": 1000000000 + show_id,
+            "summary": "<p>{}</p>".format("x" * self.summary),
+            "_embedded": embedded
+            }).encode()
+
+    def get_episodes(self, season_id):
+        """Return the JSON body with a season's episodes."""
+        show_id, season = divmod(season_id, 1000)
+        return json.dumps(self.make_episodes(show_id, season)).encode()
+
+def main():
+    parser = argparse.ArgumentParser(description="Local TVMaze stand-in.")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--seasons", type=int, default=5)
+    parser.add_argument("--episodes", type=int, default=20,
+                        help="episodes per season")
+    parser.add_argument("--summary", type=int, default=400,
+                        help="bytes of unused text per episode")
+    parser.add_argument("--latency", type=float, default=0,
+                        help="seconds every response is delayed")
+    parser.add_argument("--rate", type=float, default=0,
+                        help="fraction of requests answered with 429")
+    arguments = parser.parse_args()
+
+    server = Server(
+        ("127.0.0.1", arguments.port),
+        arguments.seasons,
+        arguments.episodes,
+        arguments.summary,
+        arguments.latency,
+        arguments.rate
+        )
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
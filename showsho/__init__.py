@@ -15,78 +15,249 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
+import sys
+import time
 
 from showsho import utils
 from showsho import show
+from showsho import fetch
+from showsho import cache
+from showsho import snapshot
+from showsho import schedule
+from showsho import daemon
+from showsho import stats
+from showsho import render
 
-def get_shows(file_path, file_hash, cache_directory):
+def get_shows(file_path, store, airing=False):
     """Return a list of showsho.show.Show() objects.
 
-    Checks if there is cached data available for the file passed to
-    showsho. If there is, it uses that data to create Show() objects.
-    Otherwise it creates them "from scratch" using only the show's
-    name.
+    Reads the show names from the file passed to showsho and checks
+    if there is cached data available for each of them in the store.
+    If there is, it uses that data to create the Show() object.
+    Otherwise it creates it "from scratch" using only the show's name.
+    If "airing" is True and the store can tell which shows are airing,
+    only those are created (and the ones not cached yet).
 
-    Additionally it returns a bool depending whether it's being run
-    for the first time or not. That is useful to decide if the
-    show's information should be fetched from the internet.
+    Additionally it returns a list with only the shows created from
+    scratch. Their information has to be fetched from the internet.
     """
-    if utils.check_cached(file_hash, cache_directory):
-        # since there's cached data, it's not being run for the first time
-        first_run = False
-        # cached file's filepath
-        cached_file = "{}/{}".format(cache_directory, file_hash)
-        shows = utils.shows_from_cache(cached_file)
-    else:
-        # since there's no cached data, it's being run for the first time
-        first_run = True
-        shows = utils.shows_from_scratch(file_path)
+    airing_keys = None
+    if airing:
+        # the cached dates don't have the delay added
+        today = utils.string_from_date(show.TODAY, show.Show.delay)
+        airing_keys = store.get_airing(today)
+
+    shows = []
+    new_shows = []
+    for title in utils.get_lines_from_file(file_path):
+        if airing_keys is not None:
+            key = cache.normalize_title(title)
+            if key not in airing_keys and store.contains(title):
+                continue
+
+        data = store.get(title)
+        if data:
+            stats.count("cache_hits")
+            shows.append(utils.show_from_data(title, data))
+        else:
+            stats.count("cache_misses")
+            s = utils.show_from_scratch(title)
+            shows.append(s)
+            new_shows.append(s)
 
-    return shows, first_run
+    return shows, new_shows
 
-def print_shows(shows, airing):
-    """Print information about Show() objects.
+def format_shows(shows, airing, format_="table", color=True):
+    """Return a string with information about Show() objects.
 
-    Prints the status and information for each show in the shows list.
-    If "airing" is True, it will only print shows that are airing.
+    Has a line with the status and information for each show in the
+    shows list, or the shows' data in another format (see
+    render.FORMATS). If "airing" is True, it will only have shows that
+    are airing. "color" turns the colors of the table on or off.
     """
-    # figure out which show's title is the longest inside the list.
-    # set the class attribute "padding" to its value
-    longest_title = max([len(s.title) for s in shows])
-    show.Show.padding = longest_title
+    return render.render(shows, airing, format_, color)
+
+def print_shows(shows, airing, format_="table", color=True):
+    """Print information about Show() objects, see format_shows().
 
+    The whole output is written at once.
+    """
+    sys.stdout.write(format_shows(shows, airing, format_, color))
+
+def print_memory(shows):
+    """Print how much memory every Show() object uses.
+
+    Also prints the size of the API responses every updated show was
+    updated from (the whole JSON documents, none of which are kept
+    after taking the data the show needs), and the totals.
+    """
+    longest_title = max([len(s.title) for s in shows])
+    total_size = 0
+    total_freed = 0
     for s in shows:
-        if airing:
-            if s.status in ["airing", "soon", "new", "last"]:
-                print(utils.pretty_status(s, show.Show.padding))
-        else:
-            print(utils.pretty_status(s, show.Show.padding))
+        size = utils.get_size(s)
+        total_size += size
+        total_freed += s.payload_size
+        print("{:<{}} | {:>8} bytes | {:>9} API bytes dropped".format(
+            s.title,
+            longest_title,
+            size,
+            s.payload_size
+            ))
+    print("{:<{}} | {:>8} bytes | {:>9} API bytes dropped".format(
+        "Total",
+        longest_title,
+        total_size,
+        total_freed
+        ))
 
-def update_shows(shows, file_hash, cache_directory):
-    """Update each show's information with data from the internet.
+def save_show(s, status, store):
+    """Update a show from its self.info and save it into the store.
 
-    First it checks if there's an internet connection, returns after
-    a notifaction if there isn't.
-    If there is connectivity, it updates each show by running the
-    Show().update method on every show in the list.
-    Finally it dumps the new data into the cache file (updates its
-    content).
+    "status" is the status of the response with the show's
+    information. The title index is updated with the show's ID, or
+    with the title which couldn't be found.
     """
-    if not utils.check_connection():
-        print("No internet connection. Cannot update shows!")
-        return
+    s.update_from_info()
+    if status != 404:
+        store.titles.add(s.title, s.show_id)
+    elif s.show_id is None:
+        store.titles.add_missing(s.title)
+    else:
+        # the ID doesn't exist anymore, search for the title next time
+        store.titles.remove(s.title)
+        s.show_id = None
+    # updates the store with the core data for the show
+    store.update(s.dump_data())
+
+def update_shows(shows, store, jobs=1):
+    """Update each show's information with data from the internet.
 
+    It downloads every show's information with the fetch module,
+    sending up to "jobs" requests at the same time over reused
+    connections. Shows are fetched by their TVMaze ID from the store's
+    title index if it's known. Titles which couldn't be found recently
+    are skipped. Shows with a long history are downloaded without
+    their episodes, which are then downloaded for the current season
+    only (see Show().is_two_step()). Cached shows are requested
+    conditionally and keep their data if it didn't change.
+    Every show is updated and saved into the cache store as soon as
+    its response arrives (see save_show()), and the response is
+    dropped right away. With the JSON store, an interrupted update
+    keeps every show saved before it. Finally it saves the title index.
+    Shows which couldn't be updated because of API errors keep their
+    cached data.
+    If there's no internet connection, it returns after a notification
+    and the cached data is used.
+    """
     print("Updating and getting data about the shows...\n")
+    shows = [s for s in shows if not store.titles.is_missing(s.title)]
     for s in shows:
-        s.update()
+        if s.show_id is None:
+            s.show_id = store.titles.get_id(s.title)
+
+    failed_shows = []
+    # the shows with a long history get the current season's episodes
+    # with a second request
+    two_step_shows = []
+
+    def handle_show(index, response):
+        s = shows[index]
+        stats.count("responses_{}".format(response.status))
+        if response.status not in (200, 304, 404):
+            # the API is having problems, keep the cached data as it is
+            failed_shows.append(s)
+            return
+        s.load_info(response)
+        if s.info and s.needs_episodes():
+            two_step_shows.append(s)
+        else:
+            save_show(s, response.status, store)
 
-    # list to hold a dictionary for every show's data
-    new_data = []
+    def handle_episodes(index, response):
+        s = two_step_shows[index]
+        s.load_episodes(response)
+        if s.info:
+            save_show(s, response.status, store)
+        else:
+            # the episodes couldn't be downloaded
+            failed_shows.append(s)
+
+    try:
+        fetch.fetch_all(
+            [s.get_query() for s in shows],
+            jobs,
+            [s.get_headers() for s in shows],
+            show.FIELDS,
+            handle_show
+            )
+    except fetch.ConnectionFailed:
+        print("No internet connection. Cannot update shows!\n")
+        return
+
+    if two_step_shows:
+        try:
+            fetch.fetch_all(
+                [s.get_episodes_query() for s in two_step_shows],
+                jobs,
+                None,
+                show.EPISODE_FIELDS,
+                handle_episodes
+                )
+        except fetch.ConnectionFailed:
+            # none of the episodes could be downloaded, the shows are
+            # updated next time
+            for s in two_step_shows:
+                s.info = None
+            failed_shows.extend(two_step_shows)
+    # saves the title index, the shows were already saved
+    store.save()
+
+    if failed_shows:
+        print("Could not update {} shows, try again later.\n".format(
+            len(failed_shows)
+            ))
+
+def sync_shows(shows, store, jobs=1):
+    """Update only the shows which TVMaze changed since the last update.
+
+    Gets the IDs and update times of the recently changed shows from
+    the "updates" endpoint, going back as far as the show in the list
+    that was synced the longest time ago. Shows whose ID isn't known
+    yet don't count, they're always updated. Then it updates the shows
+    whose time changed (or whose ID isn't known yet) by running
+    update_shows() on them.
+    The other shows are marked as synced now in the store's SyncIndex,
+    so the next sync can ask only for a shorter period of updates.
+    """
+    now = int(time.time())
+    known_shows = [s for s in shows if s.show_id is not None]
+    if known_shows:
+        oldest_sync = min(
+            max(s.synced, store.syncs.get(s.show_id)) for s in known_shows
+            )
+        try:
+            response = fetch.fetch(show.get_updates_query(now - oldest_sync))
+        except fetch.ConnectionFailed:
+            print("No internet connection. Cannot update shows!\n")
+            return
+        if response.status != 200:
+            print("Cannot get the list of updated shows!")
+            return
+        updates = response.data
+    else:
+        updates = {}
+
+    changed_shows = [s for s in shows if s.has_changed(updates)]
+    if changed_shows:
+        update_shows(changed_shows, store, jobs)
+
+    changed_ids = {id(s) for s in changed_shows}
     for s in shows:
-        # appends a dictionary with core data for the show
-        new_data.append(s.dump_data())
-    # saves it to disk, into the cache directory
-    utils.save_data(new_data, file_hash, cache_directory)
+        if id(s) not in changed_ids:
+            s.synced = now
+            store.syncs.set(s.show_id, now)
+    store.save()
 
 # disable downloading until a reliable torrent search engine is found
 #def download_shows(shows):
@@ -138,30 +309,179 @@ def update_shows(shows, file_hash, cache_directory):
 #                magnet_link
 #                ))
 
-def main(file_path, airing, update, delay):
+def run(file_path, airing, update, delay, jobs=1, smart=False, sync=False,
+        backend="json", memory=False, run_daemon=False, due=False,
+        cache_gc=False, max_size=snapshot.MAX_SIZE,
+        max_age=snapshot.MAX_AGE, format_="table", color=True):
     """Runs the main program.
 
-    Gets the file's hash and cache directory (sets it up if required).
+    Gets the cache directory (sets it up if required) and the store
+    with the cached data, using the "json" or "sqlite" backend.
     Sets the delay if passed as a flag.
-    Gets a list of Show() objects. Updates them if it's run for the
-    first time or if the "update" flag is passed. Then it prints
-    information about the show and finally if the "download" flag
+    The "jobs" argument is the number of shows updated concurrently.
+    Gets a list of Show() objects. Updates all of them if the "update"
+    flag is passed, only the ones whose data can have changed if the
+    "smart" flag is passed, only the ones changed on TVMaze if the
+    "sync" flag is passed, only the ones due according to the schedule
+    if the "due" flag is passed, otherwise only the ones which aren't
+    cached yet. The schedule of the checked shows is updated.
+    If nothing has to be updated and there's an up to date snapshot of
+    the file's shows (or an older version's cache to convert into one),
+    the shows are read from it instead. Otherwise the snapshot is
+    written after the updates.
+    Then it prints information about the show (or their memory usage
+    if the "memory" flag is passed) and finally if the "download" flag
     is passed, it downloads the new episodes.
+    If the "run_daemon" flag is passed, it keeps running instead and
+    answers the queries of other showsho processes (see daemon.py).
+    If the "cache_gc" flag is passed, it only removes the unused
+    snapshots instead (see SnapshotIndex().collect()). Snapshots over
+    the "max_size" (in bytes) and "max_age" (in seconds) limits are
+    removed whenever one is written.
+    The shows are printed in the "format_" format (see
+    render.FORMATS), with colors if "color" is True.
+    Every phase is timed by the stats module.
     """
-    file_hash = utils.get_file_hash(file_path)
-    cache_directory = utils.get_cache_dir()
-    if not os.path.exists(cache_directory):
-        os.mkdir(cache_directory)
+    with stats.phase("setup"):
+        cache_directory = utils.get_cache_dir()
+        if not os.path.exists(cache_directory):
+            os.mkdir(cache_directory)
+        store = cache.open_store(cache_directory, backend)
 
     if delay:
         show.Show.delay = True
+    if memory:
+        show.Show.measure = True
+    if run_daemon:
+        daemon.Daemon(file_path, store, cache_directory, jobs).run()
+        return
+    snapshot_index = snapshot.SnapshotIndex(cache_directory)
+    if cache_gc:
+        removed = snapshot_index.collect(max_size, max_age)
+        snapshot_index.save()
+        print("Removed {} unused snapshots.".format(len(removed)))
+        return
+
+    with stats.phase("hash"):
+        fingerprints = cache.FingerprintIndex(cache_directory)
+        file_hash = utils.get_file_hash(file_path, fingerprints)
+        fingerprints.save()
+    snapshot_path = snapshot.get_path(cache_directory, file_hash)
+    show_schedule = schedule.Schedule(cache_directory)
+    if due:
+        # nothing has to be loaded if no show is due
+        due = show_schedule.has_due(utils.get_lines_from_file(file_path))
+    updating = update or smart or sync or due
+    if not updating:
+        with stats.phase("snapshot"):
+            # the file's cache from an older version of showsho is converted
+            legacy_path = "{}/{}".format(cache_directory, file_hash)
+            if os.path.exists(legacy_path) \
+               and not os.path.exists(snapshot_path):
+                snapshot.convert(
+                    legacy_path,
+                    snapshot_path,
+                    store.get_version()
+                    )
+            cached_snapshot = snapshot.load(snapshot_path, store.get_version())
+            if cached_snapshot and not memory:
+                stats.count("snapshot_hits")
+                shows = cached_snapshot.get_shows(airing)
+                snapshot_index.touch(snapshot_path, file_path)
+                snapshot_index.save()
+            else:
+                stats.count("snapshot_misses")
+        if cached_snapshot and not memory:
+            with stats.phase("print"):
+                print_shows(shows, airing, format_, color)
+            return
+
+    with stats.phase("load"):
+        # when no show is updated, only the airing ones have to be loaded
+        airing_only = airing and not updating
+        shows, new_shows = get_shows(file_path, store, airing_only)
+        # the JSON store can't tell which shows are airing, then every
+        # show is loaded and the snapshot can be written all the same
+        all_loaded = not airing_only or len(shows) == len(
+            utils.get_lines_from_file(file_path)
+            )
 
-    shows, first_run = get_shows(file_path, file_hash, cache_directory)
+    started = time.time()
+    with stats.phase("update"):
+        if sync:
+            checked_shows = shows
+            sync_shows(shows, store, jobs)
+        elif smart:
+            checked_shows = [s for s in shows if s.is_stale()]
+            if checked_shows:
+                update_shows(checked_shows, store, jobs)
+        elif due:
+            checked_shows = show_schedule.get_due(shows, started)
+            if checked_shows:
+                update_shows(checked_shows, store, jobs)
+        elif update:
+            checked_shows = shows
+            update_shows(shows, store, jobs)
+        else:
+            checked_shows = new_shows
+            if new_shows:
+                update_shows(new_shows, store, jobs)
+
+    with stats.phase("save"):
+        show_schedule.plan(checked_shows, started)
+        show_schedule.save()
+        # saves entries imported from an older version's cache
+        store.save()
+        # shows which couldn't be downloaded are tried again next time,
+        # they'd be read from the snapshot instead
+        if all_loaded and all(s.has_data() for s in shows):
+            snapshot.write(snapshot_path, shows, store.get_version())
+            snapshot_index.add(snapshot_path, file_path)
+            snapshot_index.evict(max_size, max_age)
+            snapshot_index.save()
 
-    if update or first_run:
-        update_shows(shows, file_hash, cache_directory)
+    with stats.phase("print"):
+        if memory:
+            print_memory(shows)
+        else:
+            print_shows(shows, airing, format_, color)
 
-    print_shows(shows, airing)
+def main(file_path, airing, update, delay, jobs=1, smart=False, sync=False,
+         backend="json", memory=False, run_daemon=False, due=False,
+         stats_path=None, profile_path=None, cache_gc=False,
+         max_size=snapshot.MAX_SIZE, max_age=snapshot.MAX_AGE,
+         format_="table", color=True):
+    """Runs the main program, see run().
+
+    If "stats_path" is passed, the stats module collects timings and
+    counters during the run and writes them to it as JSON ("-" for
+    stderr). If "profile_path" is passed, the run is also profiled with
+    cProfile and tracemalloc and the results are written to it.
+    """
+    if stats_path or profile_path:
+        stats.start(profile_path)
+    try:
+        run(
+            file_path,
+            airing,
+            update,
+            delay,
+            jobs,
+            smart,
+            sync,
+            backend,
+            memory,
+            run_daemon,
+            due,
+            cache_gc,
+            max_size,
+            max_age,
+            format_,
+            color
+            )
+    finally:
+        if stats_path or profile_path:
+            stats.stop(stats_path, profile_path)
 
 # see download_shows() comment
 #    if download:
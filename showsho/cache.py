@@ -0,0 +1,665 @@
+# Showsho
+# Copyright (C) 2015-2016  Dino Duratović <dinomol at mail dot com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import fcntl
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+# older versions cached every show file in a file named after its hash
+LEGACY_FILE = re.compile("^[0-9a-f]{40}$")
+# for how many seconds a title that couldn't be found isn't searched again
+MISSING_TTL = 86400
+# a file changed this many seconds after it was hashed could still have
+# the same modification time, so its hash isn't reused
+FINGERPRINT_DELAY = 2
+# the journal is merged into the cache file once it's bigger than this
+# (in bytes) and half the file
+JOURNAL_SIZE = 65536
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS shows (
+    key TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    season INTEGER,
+    premiere TEXT NOT NULL,
+    end_date TEXT NOT NULL,
+    show_id INTEGER,
+    updated INTEGER,
+    synced INTEGER NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    season_id INTEGER,
+    episode_count INTEGER
+);
+CREATE TABLE IF NOT EXISTS episodes (
+    key TEXT NOT NULL REFERENCES shows (key),
+    number TEXT NOT NULL,
+    airdate TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS shows_premiere ON shows (premiere);
+CREATE INDEX IF NOT EXISTS shows_end_date ON shows (end_date);
+CREATE INDEX IF NOT EXISTS episodes_key ON episodes (key);
+CREATE INDEX IF NOT EXISTS episodes_airdate ON episodes (airdate);
+"""
+# columns added to the "shows" table after it was first released
+SQLITE_NEW_COLUMNS = [
+    ("season_id", "INTEGER"),
+    ("episode_count", "INTEGER")
+    ]
+
+def normalize_title(title):
+    """Return the title used as the show's key in the cache.
+
+    Ignores case and extra whitespace, so "the  Wire" and "The Wire"
+    share the same cached data.
+    """
+    return " ".join(title.split()).casefold()
+
+def read_json(path):
+    """Return the data from a JSON file or an empty dict if it's missing."""
+    try:
+        with open(path, "r") as file_:
+            return json.load(file_)
+    except FileNotFoundError:
+        return {}
+
+def write_json(path, data):
+    """Write data to a JSON file.
+
+    It's written to a temporary file first and then renamed, which
+    means the file is never left half-written.
+    """
+    temporary_path = "{}.tmp".format(path)
+    with open(temporary_path, "w") as file_:
+        json.dump(data, file_, ensure_ascii=False, indent=0)
+    os.replace(temporary_path, path)
+
+def read_journal(path):
+    """Return a list with the entries appended to a journal file.
+
+    A line which isn't valid JSON was cut short by an interrupted
+    write and is skipped.
+    """
+    entries = []
+    try:
+        with open(path, "r") as file_:
+            for line in file_:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    pass
+    except FileNotFoundError:
+        pass
+    return entries
+
+class TitleIndex:
+    """Index with the TVMaze ID for every show title.
+
+    The "singlesearch" endpoint is slow and fuzzy, so the show it finds
+    for a title can change between runs. Once a title is found, its ID
+    is saved and the show is fetched directly by ID from then on.
+
+    Titles which couldn't be found are saved too, with the time of
+    the search. They aren't searched for again until MISSING_TTL
+    seconds have passed.
+
+    Kept in a JSON file inside the cache directory, as an object with
+    the normalized title as the key and either {"id": ID} or
+    {"missing": time} as the value.
+    """
+    def __init__(self, cache_directory):
+        self.path = "{}/titles.json".format(cache_directory)
+        self.entries = None
+        self.changed = {}
+
+    def load(self):
+        """Read the index file, if it wasn't read already."""
+        if self.entries is None:
+            self.entries = read_json(self.path)
+
+    def get_id(self, title):
+        """Return the title's TVMaze ID or None if it isn't known."""
+        self.load()
+        return self.entries.get(normalize_title(title), {}).get("id")
+
+    def is_missing(self, title):
+        """Return True if the title couldn't be found recently."""
+        self.load()
+        missing = self.entries.get(normalize_title(title), {}).get("missing")
+        return missing is not None and time.time() - missing < MISSING_TTL
+
+    def set(self, title, entry):
+        """Set the title's entry in the index."""
+        self.load()
+        key = normalize_title(title)
+        self.entries[key] = entry
+        self.changed[key] = entry
+
+    def add(self, title, show_id):
+        """Save the TVMaze ID the title was resolved to."""
+        self.set(title, {"id": show_id})
+
+    def add_missing(self, title):
+        """Save that the title couldn't be found."""
+        self.set(title, {"missing": int(time.time())})
+
+    def remove(self, title):
+        """Forget the title, so it's searched for again."""
+        self.set(title, None)
+
+    def save(self):
+        """Write the changed entries to the index file.
+
+        The file is read again before writing, so entries saved by
+        another showsho process in the meantime aren't lost. Removed
+        entries are left out.
+        """
+        if not self.changed:
+            return
+        entries = read_json(self.path)
+        entries.update(self.changed)
+        entries = {k: v for k, v in entries.items() if v is not None}
+        write_json(self.path, entries)
+
+        self.entries = entries
+        self.changed = {}
+
+class FingerprintIndex:
+    """Index with the hash of every show file.
+
+    Hashing a big show file, or one on a network file system, on every
+    run is slow. The hash is saved along with the file's inode, size
+    and modification time (its fingerprint) and reused as long as the
+    fingerprint stays the same. A file modified within
+    FINGERPRINT_DELAY seconds of being hashed could be modified again
+    without changing its modification time, its hash is only reused
+    once it's been left alone for that long.
+
+    Kept in a JSON file inside the cache directory, as an object with
+    the show file's real path as the key and {"fingerprint": [inode,
+    size, mtime_ns], "hash": hash} as the value. Like TitleIndex(),
+    only the changed entries are written by save().
+    """
+    def __init__(self, cache_directory):
+        self.path = "{}/fingerprints.json".format(cache_directory)
+        self.entries = None
+        self.changed = {}
+
+    def load(self):
+        """Read the index file, if it wasn't read already."""
+        if self.entries is None:
+            self.entries = read_json(self.path)
+
+    def get(self, file_path):
+        """Return the file's saved hash (or None) and its fingerprint.
+
+        The hash is None if the fingerprint changed since it was saved.
+        """
+        self.load()
+        stat = os.stat(file_path)
+        fingerprint = [stat.st_ino, stat.st_size, stat.st_mtime_ns]
+        entry = self.entries.get(os.path.realpath(file_path))
+        if entry and entry["fingerprint"] == fingerprint:
+            return entry["hash"], fingerprint
+        return None, fingerprint
+
+    def set(self, file_path, fingerprint, file_hash):
+        """Save the file's hash with the fingerprint it had before hashing."""
+        self.load()
+        if time.time_ns() - fingerprint[2] < FINGERPRINT_DELAY * 10**9:
+            return
+        key = os.path.realpath(file_path)
+        entry = {"fingerprint": fingerprint, "hash": file_hash}
+        self.entries[key] = entry
+        self.changed[key] = entry
+
+    def save(self):
+        """Write the changed entries to the index file.
+
+        The file is read again before writing, so entries saved by
+        another showsho process in the meantime aren't lost.
+        """
+        if not self.changed:
+            return
+        entries = read_json(self.path)
+        entries.update(self.changed)
+        write_json(self.path, entries)
+
+        self.entries = entries
+        self.changed = {}
+
+class SyncIndex:
+    """Index with the time every show was last synced.
+
+    A sync (see showsho.sync_shows()) checks every show, but only
+    downloads the ones TVMaze changed. The others only get the time
+    of the sync, which is saved here instead of saving their whole
+    data again.
+
+    Kept in a JSON file inside the cache directory, as an object with
+    the show's TVMaze ID (as a string) as the key and the time as the
+    value. Like TitleIndex(), only the changed entries are written by
+    save().
+    """
+    def __init__(self, cache_directory):
+        self.path = "{}/syncs.json".format(cache_directory)
+        self.entries = None
+        self.changed = {}
+
+    def load(self):
+        """Read the index file, if it wasn't read already."""
+        if self.entries is None:
+            self.entries = read_json(self.path)
+
+    def get(self, show_id):
+        """Return the time the show was last synced, 0 if never."""
+        self.load()
+        return self.entries.get(str(show_id), 0)
+
+    def set(self, show_id, synced):
+        """Save the time the show was synced."""
+        self.load()
+        key = str(show_id)
+        self.entries[key] = synced
+        self.changed[key] = synced
+
+    def save(self):
+        """Write the changed entries to the index file.
+
+        The file is read again before writing, so entries saved by
+        another showsho process in the meantime aren't lost.
+        """
+        if not self.changed:
+            return
+        entries = read_json(self.path)
+        entries.update(self.changed)
+        write_json(self.path, entries)
+
+        self.entries = entries
+        self.changed = {}
+
+class ShowStore:
+    """Cache with every show's data, shared by all the show files.
+
+    The data is kept in a single JSON file inside the cache directory,
+    as an object with the normalized title as the key and the
+    dictionary from Show().dump_data() as the value. The show files
+    only choose which entries are used, so adding a line to a file
+    only requires downloading information about that one show.
+
+    Changed entries aren't written to that file right away, update()
+    appends them to a journal next to it instead, one JSON line per
+    show. Saving a show costs the same no matter how many are cached
+    and an interrupted update keeps every show saved before it. The
+    file is read when the store is first used and the journal is
+    replayed on top of it. See compact() for how the journal is
+    merged back into the file.
+    The store's TitleIndex is in self.titles and its SyncIndex in
+    self.syncs, they're saved along with it.
+    """
+    def __init__(self, cache_directory):
+        self.cache_directory = cache_directory
+        self.path = "{}/shows.json".format(cache_directory)
+        self.journal_path = "{}/shows.journal".format(cache_directory)
+        self.old_journal_path = "{}.old".format(self.journal_path)
+        self.lock_path = "{}/shows.lock".format(cache_directory)
+        self.compaction_lock_path = "{}/shows.compaction.lock".format(
+            cache_directory
+            )
+        self.entries = None
+        self.legacy_files = []
+        self.compaction = None
+        self.titles = TitleIndex(cache_directory)
+        self.syncs = SyncIndex(cache_directory)
+
+    def read(self):
+        """Return the entries saved in the cache file and the journals."""
+        entries = read_json(self.path)
+        for path in (self.old_journal_path, self.journal_path):
+            for data in read_journal(path):
+                entries[normalize_title(data["title"])] = data
+        return entries
+
+    def load(self):
+        """Read the cache file, if it wasn't read already.
+
+        If there's no cache file or journal yet, the files cached by
+        older versions are imported instead.
+        """
+        if self.entries is not None:
+            return
+        paths = (self.path, self.journal_path, self.old_journal_path)
+        if any(os.path.exists(path) for path in paths):
+            self.entries = self.read()
+        else:
+            self.entries = {}
+            self.import_legacy_files()
+
+    def reload(self):
+        """Read the files again when next used.
+
+        Gets the shows saved by other showsho processes.
+        """
+        self.entries = None
+        self.titles.entries = None
+        self.syncs.entries = None
+
+    def get(self, title):
+        """Return the cached data for the title or None."""
+        self.load()
+        return self.entries.get(normalize_title(title))
+
+    def get_version(self, *paths):
+        """Return the latest modification time of the cache's files.
+
+        In nanoseconds. Changes every time a show is saved, but not
+        when the journal is compacted. 0 if nothing was saved yet.
+        Only the "paths" are checked if any are passed.
+        """
+        if not paths:
+            paths = (self.path, self.journal_path, self.old_journal_path)
+        version = 0
+        for path in paths:
+            try:
+                version = max(version, os.stat(path).st_mtime_ns)
+            except FileNotFoundError:
+                pass
+        return version
+
+    def get_airing(self, today):
+        """Return None, the JSON file has no index of airing shows.
+
+        See SQLiteStore().get_airing().
+        """
+        return None
+
+    def contains(self, title):
+        """Return True if there's cached data for the title."""
+        return self.get(title) is not None
+
+    def update(self, data):
+        """Set the cached data for a show and append it to the journal.
+
+        Takes a dictionary from Show().dump_data().
+        """
+        self.load()
+        self.entries[normalize_title(data["title"])] = data
+        line = "{}\n".format(json.dumps(data, ensure_ascii=False)).encode()
+        # a shared lock, so compact() doesn't move the journal away
+        # while it's being written to
+        with open(self.lock_path, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_SH)
+            with open(self.journal_path, "ab+") as file_:
+                end = file_.tell()
+                # don't continue a line cut short by an interrupted write
+                if end and os.pread(file_.fileno(), 1, end - 1) != b"\n":
+                    line = b"\n" + line
+                file_.write(line)
+
+    def needs_compaction(self):
+        """Return True if the journal should be merged into the file."""
+        if os.path.exists(self.old_journal_path):
+            return True
+        try:
+            journal_size = os.stat(self.journal_path).st_size
+        except FileNotFoundError:
+            return False
+        try:
+            size = os.stat(self.path).st_size
+        except FileNotFoundError:
+            size = 0
+        return journal_size > max(JOURNAL_SIZE, size // 2)
+
+    def compact(self):
+        """Merge the journal into the cache file.
+
+        The journal is renamed first, so other updates can keep
+        appending to a new one, and removed once the cache file with
+        its entries has replaced the old one. If the process stops
+        half way, the renamed journal is replayed by read() and merged
+        by the next compaction, nothing is lost. Only one process
+        compacts at a time, the others skip it: the compaction lock is
+        held until the renamed journal is removed, the store's lock only
+        while the journal is renamed.
+        """
+        with open(self.compaction_lock_path, "a") as compaction_lock:
+            try:
+                fcntl.flock(compaction_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return
+            # left over if the last compaction was interrupted, then it's
+            # merged first and the journal waits for the next one
+            if not os.path.exists(self.old_journal_path):
+                # waits for the updates writing to the journal
+                with open(self.lock_path, "a") as lock:
+                    fcntl.flock(lock, fcntl.LOCK_EX)
+                    try:
+                        os.replace(self.journal_path, self.old_journal_path)
+                    except FileNotFoundError:
+                        return
+
+            # the data doesn't change, so neither should get_version():
+            # the file gets the latest modification time of the two
+            version = self.get_version(self.path, self.old_journal_path)
+            entries = read_json(self.path)
+            for data in read_journal(self.old_journal_path):
+                entries[normalize_title(data["title"])] = data
+            write_json(self.path, entries)
+            os.utime(self.path, ns=(version, version))
+            os.remove(self.old_journal_path)
+
+    def save(self):
+        """Save the indexes and compact the journal if it's big.
+
+        The shows themselves were already saved by update(). The
+        compaction runs in a thread, so the output doesn't wait for
+        it; the interpreter does before exiting.
+        """
+        self.titles.save()
+        self.syncs.save()
+        if self.legacy_files:
+            self.compact()
+            for legacy_path in self.legacy_files:
+                os.remove(legacy_path)
+            self.legacy_files = []
+            return
+        if self.compaction and self.compaction.is_alive():
+            return
+        if self.needs_compaction():
+            self.compaction = threading.Thread(target=self.compact)
+            self.compaction.start()
+
+    def import_legacy_files(self):
+        """Import the cache files of older versions.
+
+        Those cached a list of every show's data per show file, in a
+        file named after the show file's hash. Their entries are added
+        to the store and the old files are removed on the next save().
+        """
+        for file_name in os.listdir(self.cache_directory):
+            if not LEGACY_FILE.match(file_name):
+                continue
+            legacy_path = "{}/{}".format(self.cache_directory, file_name)
+            try:
+                with open(legacy_path, "r") as file_:
+                    legacy_data = json.load(file_)
+            except ValueError:
+                # a half-written file, nothing useful in it
+                legacy_data = []
+            for data in legacy_data:
+                self.update(data)
+            self.legacy_files.append(legacy_path)
+
+class SQLiteStore:
+    """Cache with every show's data in an SQLite database.
+
+    An alternative to ShowStore() with the same methods. Every show is
+    a row in the "shows" table and every episode a row in "episodes",
+    indexed by their dates. Reading a show only touches its own rows
+    and get_airing() can find the airing shows without loading all of
+    them. Writing a show replaces only its rows, the changes are
+    committed by save().
+
+    A new database is filled with the shows from the JSON store.
+    """
+    def __init__(self, cache_directory):
+        self.path = "{}/shows.sqlite".format(cache_directory)
+        new_database = not os.path.exists(self.path)
+        self.connection = sqlite3.connect(self.path)
+        self.connection.executescript(SQLITE_SCHEMA)
+        self.add_new_columns()
+        self.titles = TitleIndex(cache_directory)
+        self.syncs = SyncIndex(cache_directory)
+
+        if new_database:
+            json_store = ShowStore(cache_directory)
+            json_store.load()
+            for data in json_store.entries.values():
+                self.update(data)
+            self.connection.commit()
+
+    def add_new_columns(self):
+        """Add the columns a database made by an older version lacks."""
+        columns = {
+            row[1] for row in
+            self.connection.execute("PRAGMA table_info(shows)")
+            }
+        for name, column_type in SQLITE_NEW_COLUMNS:
+            if name not in columns:
+                self.connection.execute(
+                    "ALTER TABLE shows ADD COLUMN {} {}".format(
+                        name,
+                        column_type
+                        )
+                    )
+
+    def reload(self):
+        """Read the indexes again when next used.
+
+        The database is always read as it is, see ShowStore().reload().
+        """
+        self.titles.entries = None
+        self.syncs.entries = None
+
+    def get(self, title):
+        """Return the cached data for the title or None."""
+        key = normalize_title(title)
+        row = self.connection.execute(
+            "SELECT title, season, premiere, end_date, show_id, updated,"
+            " synced, etag, last_modified, season_id, episode_count"
+            " FROM shows WHERE key = ?",
+            (key,)
+            ).fetchone()
+        if row is None:
+            return None
+
+        # rowid keeps the episodes in the order they were saved in
+        episodes = self.connection.execute(
+            "SELECT number, airdate FROM episodes WHERE key = ?"
+            " ORDER BY rowid",
+            (key,)
+            )
+        return {
+            "title": row[0],
+            "season": row[1],
+            "premiere": row[2],
+            "end": row[3],
+            "episodes": dict(episodes),
+            "id": row[4],
+            "updated": row[5],
+            "synced": row[6],
+            "etag": row[7],
+            "last_modified": row[8],
+            "season_id": row[9],
+            "episode_count": row[10]
+            }
+
+    def get_version(self):
+        """Return the database's modification time in nanoseconds."""
+        return os.stat(self.path).st_mtime_ns
+
+    def get_airing(self, today):
+        """Return a set with the keys of shows which might be airing.
+
+        "today" is an ISO 8601 date string. Those are the shows whose
+        season ends today or later or premieres after today, and the
+        shows with an episode airing today. The indexes on the dates
+        are used, so only the matching rows are read.
+        """
+        rows = self.connection.execute(
+            "SELECT key FROM shows WHERE end_date >= :today"
+            " UNION SELECT key FROM shows WHERE premiere > :today"
+            " UNION SELECT key FROM episodes WHERE airdate = :today",
+            {"today": today}
+            )
+        return {row[0] for row in rows}
+
+    def contains(self, title):
+        """Return True if there's cached data for the title."""
+        row = self.connection.execute(
+            "SELECT 1 FROM shows WHERE key = ?",
+            (normalize_title(title),)
+            ).fetchone()
+        return row is not None
+
+    def update(self, data):
+        """Set the cached data for a show.
+
+        Takes a dictionary from Show().dump_data().
+        """
+        key = normalize_title(data["title"])
+        self.connection.execute("DELETE FROM episodes WHERE key = ?", (key,))
+        self.connection.execute(
+            "INSERT OR REPLACE INTO shows (key, title, season, premiere,"
+            " end_date, show_id, updated, synced, etag, last_modified,"
+            " season_id, episode_count)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                key,
+                data["title"],
+                data["season"],
+                data["premiere"],
+                data["end"],
+                # not saved by older versions
+                data.get("id"),
+                data.get("updated"),
+                data.get("synced", 0),
+                data.get("etag"),
+                data.get("last_modified"),
+                data.get("season_id"),
+                data.get("episode_count")
+                )
+            )
+        self.connection.executemany(
+            "INSERT INTO episodes VALUES (?, ?, ?)",
+            [(key, str(n), date) for n, date in data["episodes"].items()]
+            )
+
+    def save(self):
+        """Commit the changed shows and save the indexes."""
+        self.titles.save()
+        self.syncs.save()
+        self.connection.commit()
+
+def open_store(cache_directory, backend="json"):
+    """Return the store for the "json" or "sqlite" backend."""
+    if backend == "sqlite":
+        return SQLiteStore(cache_directory)
+    return ShowStore(cache_directory)
@@ -0,0 +1,214 @@
+# Showsho
+# Copyright (C) 2015-2016  Dino Duratović <dinomol at mail dot com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import datetime
+import json
+import os
+import signal
+import socket
+import socketserver
+import sys
+import threading
+import time
+
+import showsho
+from showsho import show
+from showsho import schedule
+from showsho import render
+
+def get_socket_path(cache_directory):
+    """Return the path of the daemon's socket.
+
+    bin/showsho builds the same path without importing showsho, keep
+    them in sync.
+    """
+    return "{}/daemon.sock".format(cache_directory)
+
+def get_file_version(file_path):
+    """Return a tuple which changes when the file is changed."""
+    stat = os.stat(file_path)
+    return stat.st_mtime_ns, stat.st_size
+
+def get_midnight():
+    """Return the time the next day starts."""
+    tomorrow = datetime.date.today() + datetime.timedelta(days=1)
+    return datetime.datetime.combine(tomorrow, datetime.time()).timestamp()
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    """Answers a single query sent to the daemon's socket.
+
+    A query is a line with a JSON object with the show file's path,
+    the "airing", "delay" and "color" flags and the output "format".
+    The answer is a line with a JSON
+    object with either the "output" to print or an "error".
+    """
+    def handle(self):
+        try:
+            query = json.loads(self.rfile.readline().decode())
+        except ValueError:
+            return
+        answer = self.server.showsho_daemon.answer(query)
+        self.wfile.write("{}\n".format(json.dumps(answer)).encode())
+
+class Server(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, showsho_daemon):
+        self.showsho_daemon = showsho_daemon
+        super().__init__(path, RequestHandler)
+
+class Daemon:
+    """Keeps a show file's shows in memory and answers queries about them.
+
+    Starting showsho every time it's used means starting the
+    interpreter, importing everything and loading the cached shows,
+    which is too slow for a shell prompt or a status bar. The daemon
+    does that once and then answers the queries of bin/showsho over a
+    Unix socket in the cache directory. The output for every format,
+    with and without the "airing" flag and colors, is formatted in
+    advance, so a query only has to look it up.
+
+    The queries are answered by the server's threads, everything else
+    is done by the main thread: at midnight the day changes, which
+    changes the shows' status, and the shows are refreshed from the
+    internet when they're due according to the schedule (see
+    schedule.py). When the show file or the cached shows change (they
+    are updated by other showsho processes too), the shows are loaded
+    again.
+    """
+    def __init__(self, file_path, store, cache_directory, jobs=1):
+        self.file_path = os.path.realpath(file_path)
+        self.store = store
+        self.cache_directory = cache_directory
+        self.schedule = schedule.Schedule(cache_directory)
+        self.jobs = jobs
+        self.shows = []
+        self.output = {}
+        self.file_version = None
+        self.store_version = None
+        self.reload = threading.Event()
+
+    def load(self):
+        """Load the file's shows, downloading the ones not cached yet."""
+        self.file_version = get_file_version(self.file_path)
+        self.store.reload()
+        self.store_version = self.store.get_version()
+        # other processes update the schedule along with the shows
+        self.schedule = schedule.Schedule(self.cache_directory)
+        shows, new_shows = showsho.get_shows(self.file_path, self.store)
+        self.shows = shows
+        self.update(new_shows)
+
+    def refresh(self):
+        """Change the day if needed and refresh the due shows."""
+        today = datetime.date.today()
+        if today != show.TODAY:
+            show.TODAY = today
+            for s in self.shows:
+                s.reset_status()
+        self.update(self.schedule.get_due(self.shows))
+
+    def update(self, shows):
+        """Update the shows, plan their next check and format the output."""
+        started = time.time()
+        if shows:
+            showsho.update_shows(shows, self.store, self.jobs)
+        self.schedule.plan(shows, started)
+        self.schedule.save()
+        self.store.save()
+        # the daemon's own changes
+        self.store_version = self.store.get_version()
+        self.format()
+
+    def get_timeout(self):
+        """Return the seconds until the next day or the next due show."""
+        wake = get_midnight()
+        next_time = self.schedule.get_next_time(self.shows)
+        if next_time is not None:
+            wake = min(wake, next_time)
+        # a second late rather than early
+        return max(0, wake - time.time()) + 1
+
+    def format(self):
+        """Format the output for the queries in advance."""
+        output = {}
+        for airing in (False, True):
+            for format_ in render.FORMATS:
+                # only the table has colors
+                colors = (False, True) if format_ == "table" else (False,)
+                for color in colors:
+                    output[airing, format_, color] = showsho.format_shows(
+                        self.shows,
+                        airing,
+                        format_,
+                        color
+                        )
+        self.output = output
+
+    def answer(self, query):
+        """Return the answer for a query, see RequestHandler()."""
+        try:
+            file_path = os.path.realpath(query["file"])
+            airing = bool(query["airing"])
+            delay = bool(query["delay"])
+            format_ = query["format"]
+            color = bool(query["color"]) and format_ == "table"
+        except (KeyError, TypeError):
+            return {"error": "Invalid query"}
+        if format_ not in render.FORMATS:
+            return {"error": "Invalid query"}
+        if file_path != self.file_path or delay != show.Show.delay:
+            return {"error": "The daemon is running for another show file"}
+        try:
+            if get_file_version(self.file_path) != self.file_version:
+                self.reload.set()
+                return {"error": "The show file changed"}
+        except OSError:
+            return {"error": "The show file can't be read"}
+        if self.store.get_version() != self.store_version:
+            self.reload.set()
+            return {"error": "The cached shows changed"}
+        return {"output": self.output[airing, format_, color]}
+
+    def run(self):
+        """Answer queries until the process is stopped."""
+        socket_path = get_socket_path(self.cache_directory)
+        try:
+            with socket.socket(socket.AF_UNIX) as client:
+                client.connect(socket_path)
+            print("The daemon is already running.")
+            return
+        except OSError:
+            # nothing is listening, the socket is left over
+            if os.path.exists(socket_path):
+                os.remove(socket_path)
+
+        self.load()
+        server = Server(socket_path, self)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        # stop cleanly on "kill" too, so the socket is removed
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit())
+        try:
+            while True:
+                if self.reload.wait(self.get_timeout()):
+                    self.reload.clear()
+                    self.load()
+                else:
+                    self.refresh()
+        finally:
+            server.shutdown()
+            server.server_close()
+            os.remove(socket_path)
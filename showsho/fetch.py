@@ -0,0 +1,471 @@
+# Showsho
+# Copyright (C) 2015-2016  Dino Duratović <dinomol at mail dot com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import collections
+import concurrent.futures
+import email.utils
+import http.client
+import io
+import random
+import socket
+import threading
+import time
+import urllib.parse
+import zlib
+
+from showsho import projection
+from showsho import stats
+
+HEADERS = {
+    "User-Agent": "showsho",
+    "Connection": "keep-alive",
+    "Accept-Encoding": "gzip, deflate"
+    }
+# how many bytes are read from the socket at once
+CHUNK_SIZE = 65536
+# TVMaze allows at least 20 requests every 10 seconds
+RATE = 2
+BURST = 20
+# how many times a request is retried after a 429, 5xx or a timeout
+RETRIES = 4
+# first backoff delay and the longest one (also caps "Retry-After")
+BACKOFF = 1
+MAX_BACKOFF = 60
+# seconds to wait for the server before giving up on a request
+TIMEOUT = 30
+# seconds to wait while connecting, kept short so showsho doesn't hang
+# when there is no network
+CONNECT_TIMEOUT = 5
+# status of the Response for a request which got no answer at all, it
+# timed out or the connection broke every time it was tried
+NO_RESPONSE = 0
+
+# "headers" is a http.client.HTTPMessage, "data" is the decoded JSON
+# body (or only its wanted fields) of a successful response and None
+# otherwise, "size" is the size of the whole (decompressed) body in bytes
+Response = collections.namedtuple(
+    "Response",
+    ["status", "headers", "data", "size"]
+    )
+
+class ConnectionFailed(OSError):
+    """Raised when a connection to the server can't be made at all.
+
+    Usually means there's no internet connection, so the request isn't
+    retried and showsho can fall back to the cached data right away.
+    """
+
+class ConnectTimeout:
+    """Mixin for http.client connections with a short connect timeout.
+
+    Connecting (and the TLS handshake) uses CONNECT_TIMEOUT, the
+    connection's own timeout is used for the requests afterwards.
+    Every error while connecting is raised as ConnectionFailed.
+    """
+    def connect(self):
+        timeout = self.timeout
+        self.timeout = CONNECT_TIMEOUT
+        try:
+            super().connect()
+        except OSError as error:
+            raise ConnectionFailed(error) from error
+        finally:
+            self.timeout = timeout
+        self.sock.settimeout(timeout)
+
+class HTTPConnection(ConnectTimeout, http.client.HTTPConnection):
+    pass
+
+class HTTPSConnection(ConnectTimeout, http.client.HTTPSConnection):
+    pass
+
+class BodyReader(io.RawIOBase):
+    """File-like object with the decompressed body of a response.
+
+    Reads the (gzip or deflate compressed) body from the socket in
+    chunks and decompresses them as they are read, so the whole
+    compressed body is never in memory. Wrapped in an io.TextIOWrapper
+    it gives the JSON parser the decoded text directly.
+    """
+    def __init__(self, response):
+        self.response = response
+        self.pending = b""
+        # bytes read from the socket and after decompressing them
+        self.size = 0
+        self.decoded_size = 0
+        # seconds spent waiting for the socket
+        self.read_seconds = 0
+        encoding = response.getheader("Content-Encoding", "identity")
+        if encoding in ("gzip", "deflate"):
+            # detects both the gzip and the zlib header automatically
+            self.decompressor = zlib.decompressobj(zlib.MAX_WBITS | 32)
+        else:
+            self.decompressor = None
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self.pending:
+            start = time.perf_counter()
+            chunk = self.response.read(CHUNK_SIZE)
+            self.read_seconds += time.perf_counter() - start
+            if not chunk:
+                if self.decompressor:
+                    self.pending = self.decompressor.flush()
+                    self.decoded_size += len(self.pending)
+                    self.decompressor = None
+                    continue
+                return 0
+            self.size += len(chunk)
+            if self.decompressor:
+                chunk = self.decompressor.decompress(chunk)
+            self.decoded_size += len(chunk)
+            self.pending = chunk
+
+        size = min(len(buffer), len(self.pending))
+        buffer[:size] = self.pending[:size]
+        self.pending = self.pending[size:]
+        return size
+
+class ConnectionPool:
+    """A small pool of keep-alive connections to a single host.
+
+    Holds up to "size" http.client connections which are reused for
+    every request sent through the pool, so the TCP (and TLS) setup
+    is only done once per connection instead of once per request.
+    The size of the pool is also the maximum number of requests that
+    are running at the same time.
+
+    The blocking http.client calls are run in a thread pool of the
+    same size, so they can be awaited from the asyncio event loop.
+    """
+    def __init__(self, scheme, host, size, timeout):
+        if scheme == "https":
+            connection_class = HTTPSConnection
+        else:
+            connection_class = HTTPConnection
+
+        self.idle = asyncio.Queue()
+        self.connections = []
+        for i in range(size):
+            connection = connection_class(host, timeout=timeout)
+            self.connections.append(connection)
+            self.idle.put_nowait(connection)
+        self.executor = concurrent.futures.ThreadPoolExecutor(size)
+
+    async def get(self, path, headers, fields):
+        """Return the response to a GET request for "path".
+
+        Waits for an idle connection, sends the request over it and
+        puts the connection back into the pool when done.
+        """
+        connection = await self.idle.get()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self.executor,
+                request,
+                connection,
+                path,
+                headers,
+                fields
+                )
+        finally:
+            self.idle.put_nowait(connection)
+
+    def close(self):
+        """Close all the connections and stop the threads."""
+        self.executor.shutdown()
+        for connection in self.connections:
+            connection.close()
+
+def request(connection, path, headers=None, fields=None):
+    """Return a Response for a GET request.
+
+    Sends a GET request over an (already opened or new) connection,
+    with additional "headers" if there are any. The server may close
+    an idle keep-alive connection at any time, in which case the
+    request is sent once more over a new one. If that fails too,
+    ConnectionFailed is raised.
+
+    The body of a successful response is decompressed and decoded as
+    it's read from the socket and streamed into the JSON parser (see
+    projection.load()). If "fields" is given, only those fields are
+    kept (see projection.Parser()) and the rest of the body is
+    skipped.
+    The request is recorded in the stats module, with the time spent
+    reading the body from the socket and the rest of the time spent on
+    the body (decompressing and parsing it) separately.
+    """
+    start = time.perf_counter()
+    request_headers = dict(HEADERS)
+    if headers:
+        request_headers.update(headers)
+
+    for attempt in range(2):
+        try:
+            connection.request("GET", path, headers=request_headers)
+            response = connection.getresponse()
+            break
+        except (ConnectionResetError, BrokenPipeError) as error:
+            connection.close()
+            if attempt:
+                # not even a new connection works
+                raise ConnectionFailed(error) from error
+        except:
+            # the connection is stuck in the middle of the request (after
+            # a timeout for example) and can't be reused
+            connection.close()
+            raise
+
+    # the body has to be read completely before the connection can be
+    # used for the next request
+    body_start = time.perf_counter()
+    try:
+        if response.status == 200:
+            reader = BodyReader(response)
+            body = io.TextIOWrapper(
+                io.BufferedReader(reader, CHUNK_SIZE),
+                encoding="utf-8"
+                )
+            # everything is kept without "fields"
+            data = projection.load(body, True if fields is None else fields)
+            size = reader.size
+            body_size = reader.decoded_size
+            read_seconds = reader.read_seconds
+        else:
+            size = body_size = len(response.read())
+            data = None
+            read_seconds = None
+    except:
+        # a half-read response, the connection can't be reused
+        connection.close()
+        raise
+
+    end = time.perf_counter()
+    if read_seconds is None:
+        read_seconds = end - body_start
+    stats.add_request(
+        path,
+        response.status,
+        end - start,
+        read_seconds,
+        end - body_start - read_seconds,
+        size
+        )
+    return Response(response.status, response.msg, data, body_size)
+
+class RateLimiter:
+    """Token bucket limiting how many requests are sent per second.
+
+    The bucket holds up to "burst" tokens and is refilled with "rate"
+    tokens per second. Every request takes a token and waits if there
+    are none left. pause() stops all requests for a while, which is
+    used when the server asks to slow down.
+    Thread-safe, the same limiter can be used by every request.
+    """
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.monotonic()
+        self.paused_until = 0
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        """Take a token and return the seconds to wait before using it."""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.burst,
+                self.tokens + (now - self.last) * self.rate
+                )
+            self.last = now
+            self.tokens -= 1
+            wait = max(0, -self.tokens / self.rate)
+            return max(wait, self.paused_until - now)
+
+    def pause(self, seconds):
+        """Don't let any requests through for "seconds"."""
+        with self.lock:
+            self.paused_until = max(
+                self.paused_until,
+                time.monotonic() + seconds
+                )
+
+    async def acquire(self):
+        """Wait until a request can be sent."""
+        await asyncio.sleep(self.reserve())
+
+def get_retry_after(response):
+    """Return the seconds from the "Retry-After" header or None.
+
+    The header has either a number of seconds or a HTTP date.
+    """
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    if value.isdigit():
+        return int(value)
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+        return max(0, date.timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def get_backoff(attempt):
+    """Return the seconds to wait before retrying, with some jitter."""
+    delay = min(MAX_BACKOFF, BACKOFF * 2 ** attempt)
+    return delay + random.uniform(0, BACKOFF)
+
+class Client:
+    """Client for the TVMaze API shared by all the requests of a run.
+
+    Every request waits for the rate limiter first. Requests which
+    time out, break off or get a "429 Too Many Requests" or a 5xx
+    response are retried up to "retries" times, waiting as long as the
+    "Retry-After" header says or backing off exponentially. A 429
+    also pauses the rate limiter, so the other requests slow down too.
+    If the request still fails, the last response is returned (or one
+    with the NO_RESPONSE status if there was none), so it's never
+    mistaken for a missing show.
+    Failing to connect before any request of fetch_urls() got a
+    response means there's no connection, that isn't retried and
+    ConnectionFailed is raised. Once the server answered, it's retried
+    like a timeout. self.answered is set by the first response.
+    """
+    def __init__(self, rate=RATE, burst=BURST, retries=RETRIES,
+                 timeout=TIMEOUT):
+        self.limiter = RateLimiter(rate, burst)
+        self.retries = retries
+        self.timeout = timeout
+        self.answered = False
+
+    async def get(self, pool, path, headers, fields):
+        """Return the Response for "path", sent through the pool."""
+        for attempt in range(self.retries + 1):
+            last_attempt = attempt == self.retries
+            await self.limiter.acquire()
+            try:
+                response = await pool.get(path, headers, fields)
+            except (socket.timeout, ConnectionError, ConnectionFailed,
+                    http.client.HTTPException) as error:
+                if isinstance(error, ConnectionFailed) and not self.answered:
+                    raise
+                if last_attempt:
+                    return Response(NO_RESPONSE, None, None, 0)
+                await asyncio.sleep(get_backoff(attempt))
+                continue
+
+            self.answered = True
+            if response.status != 429 and response.status < 500:
+                return response
+            if last_attempt:
+                return response
+
+            delay = get_retry_after(response)
+            if delay is None:
+                delay = get_backoff(attempt)
+            delay = min(delay, MAX_BACKOFF)
+            if response.status == 429:
+                self.limiter.pause(delay)
+            await asyncio.sleep(delay)
+
+    async def get_url(self, index, pool, path, headers, fields, callback):
+        """Return the Response for "path" or pass it to the callback.
+
+        See fetch_urls(), "index" is the URL's index.
+        """
+        response = await self.get(pool, path, headers, fields)
+        if callback is None:
+            return response
+        callback(index, response)
+
+    async def fetch_urls(self, urls, jobs, headers, fields, callback=None):
+        """Return a list with the Responses for all the URLs.
+
+        Creates a connection pool with "jobs" connections for every
+        host and sends all the requests through them. "headers" is a
+        list with additional headers (or None) for every URL and
+        "fields" the fields kept from every response body (None keeps
+        everything). The responses are in the same order as the URLs.
+        If a "callback" is passed, every Response is passed to it as
+        soon as it arrives instead, along with its URL's index, and
+        isn't kept (the list has only None).
+        If a request raises an exception, the others are cancelled and
+        it's raised, so no time is wasted when the first requests show
+        there's no connection.
+        """
+        self.answered = False
+        pools = {}
+        tasks = []
+        try:
+            for url, url_headers in zip(urls, headers):
+                parts = urllib.parse.urlsplit(url)
+                key = (parts.scheme, parts.netloc)
+                if key not in pools:
+                    pools[key] = ConnectionPool(
+                        parts.scheme,
+                        parts.netloc,
+                        jobs,
+                        self.timeout
+                        )
+                path = parts.path
+                if parts.query:
+                    path = "{}?{}".format(path, parts.query)
+                tasks.append(asyncio.ensure_future(self.get_url(
+                    len(tasks),
+                    pools[key],
+                    path,
+                    url_headers,
+                    fields,
+                    callback
+                    )))
+            return await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            for pool in pools.values():
+                pool.close()
+
+    def fetch_all(self, urls, jobs=1, headers=None, fields=None,
+                  callback=None):
+        """Return a list with the Responses for all the URLs.
+
+        Runs fetch_urls() in a new asyncio event loop.
+        """
+        if headers is None:
+            headers = [None] * len(urls)
+        return asyncio.run(
+            self.fetch_urls(urls, jobs, headers, fields, callback)
+            )
+
+# the client used by fetch_all() and fetch()
+client = Client()
+
+def fetch_all(urls, jobs=1, headers=None, fields=None, callback=None):
+    """Return a list with the Responses for all the URLs.
+
+    See Client().fetch_urls() for the "callback".
+    """
+    return client.fetch_all(urls, jobs, headers, fields, callback)
+
+def fetch(url, headers=None, fields=None):
+    """Return the Response for a single URL."""
+    return client.fetch_all([url], 1, [headers], fields)[0]
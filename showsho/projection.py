@@ -0,0 +1,296 @@
+# Showsho
+# Copyright (C) 2015-2016  Dino Duratović <dinomol at mail dot com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import re
+
+# how many characters are read from the file at once
+CHUNK_SIZE = 65536
+
+DECODER = json.JSONDecoder()
+WHITESPACE = re.compile(r"[ \t\n\r]*")
+# the characters which can follow a complete number, true, false or null
+DELIMITERS = ",]} \t\n\r"
+STRING = re.compile(r'"(?:[^"\\]|\\.)*"', re.DOTALL)
+# everything up to the next bracket, skipping over whole strings
+SKIP = re.compile(r'(?:[^"\[\]{}]+|"(?:[^"\\]|\\.)*")*', re.DOTALL)
+
+class Parser:
+    """Streaming JSON parser which only keeps the wanted fields.
+
+    Reads the JSON text from a file in chunks and parses it according
+    to "fields", which describes the parts of the document to keep:
+
+        True      keep the whole value
+        {...}     an object, keep only the keys listed in the
+                  dictionary, each with its own description
+        [...]     an array, every item is described by the list's
+                  only element
+
+    Everything else is skipped by scanning for the end of the value
+    with a regular expression, no Python objects are made for it.
+    The values that are kept are decoded by the json module's (C)
+    decoder. So are small objects of which only some keys are kept
+    (like the episodes), one at a time, because going through their
+    keys in Python is a lot slower than decoding them. The rest of
+    such an object is thrown away right after it's decoded.
+    If a value doesn't have the expected type (a null instead of an
+    object, for example) it's kept as it is.
+
+    Invalid JSON raises ValueError, like json.load() does.
+    """
+    def __init__(self, file_):
+        self.file_ = file_
+        self.buffer = ""
+        self.position = 0
+        self.eof = False
+
+    def fill(self, size=0):
+        """Read more data, return False if there's none left."""
+        if self.eof:
+            return False
+        chunk = self.file_.read(max(size, CHUNK_SIZE))
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.position:] + chunk
+        self.position = 0
+        return True
+
+    def error(self, message):
+        raise ValueError("{} at character {}".format(message, self.position))
+
+    def peek(self):
+        """Return the next character after any whitespace."""
+        while True:
+            self.position = WHITESPACE.match(
+                self.buffer,
+                self.position
+                ).end()
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            if not self.fill():
+                self.error("Unexpected end of data")
+
+    def expect(self, character):
+        if self.peek() != character:
+            self.error("Expected {!r}".format(character))
+        self.position += 1
+
+    def parse(self, fields):
+        """Return the next value, projected according to "fields"."""
+        character = self.peek()
+        if character == "{" and isinstance(fields, dict):
+            if all(key_fields is True for key_fields in fields.values()):
+                value = self.decode()
+                return {key: value[key] for key in fields if key in value}
+            return self.parse_object(fields)
+        if character == "[" and isinstance(fields, list):
+            return self.parse_array(fields[0])
+        return self.decode()
+
+    def decode(self):
+        """Return the next value, decoded completely."""
+        self.peek()
+        while True:
+            try:
+                value, end = DECODER.raw_decode(self.buffer, self.position)
+            except ValueError:
+                # the value goes on in the next chunk. the amount read
+                # grows with the buffer, so long values aren't decoded
+                # again for every chunk
+                if not self.fill(len(self.buffer)):
+                    raise
+                continue
+            # a number might go on in the next chunk too ("12." is
+            # decoded as 12), it's only complete if a delimiter follows
+            complete = self.buffer[self.position] in '"{[' or (
+                end < len(self.buffer) and self.buffer[end] in DELIMITERS
+                )
+            if complete or not self.fill():
+                self.position = end
+                return value
+
+    def stream(self):
+        """Return the next value, reading a container a chunk at a time.
+
+        json.load() and decode() need the whole value in memory as
+        text, here the buffer only holds about a chunk. The complete
+        items in the buffer are decoded at once by decode_items(), the
+        item cut off at the end of the buffer is decoded on its own.
+        """
+        opening = self.peek()
+        if opening not in "{[":
+            return self.decode()
+        closing = "}" if opening == "{" else "]"
+        self.position += 1
+        data = {} if opening == "{" else []
+        if self.peek() == closing:
+            self.position += 1
+            return data
+
+        tried = None
+        item_end = None
+        while True:
+            if self.buffer is not tried:
+                tried = self.buffer
+                if self.decode_items(opening, data, item_end):
+                    continue
+
+            if opening == "{":
+                if self.peek() != '"':
+                    self.error("Expected a key")
+                key = self.decode()
+                self.expect(":")
+                data[key] = self.decode()
+            else:
+                data.append(self.decode())
+            item_end = self.buffer[self.position - 1]
+            character = self.peek()
+            self.position += 1
+            if character == closing:
+                return data
+            if character != ",":
+                self.error("Expected ',' or {!r}".format(closing))
+
+    def decode_items(self, opening, data, item_end=None):
+        """Add the container's complete items in the buffer to "data".
+
+        They are the items up to a comma, wrapped in brackets and
+        decoded at once. The comma is the last one right after
+        "item_end" (the last character of another item, the items are
+        usually alike), or else the last one in the buffer. If it's
+        inside an item (a string or a nested container) the wrapped
+        text isn't valid and nothing is added.
+        Return True if any items were added.
+        """
+        closing = "}" if opening == "{" else "]"
+        separators = [","]
+        if item_end and item_end != ",":
+            separators.insert(0, item_end + ",")
+        for separator in separators:
+            cut = self.buffer.rfind(separator, self.position)
+            if cut == -1:
+                continue
+            cut += len(separator) - 1
+            text = "".join((opening, self.buffer[self.position:cut], closing))
+            try:
+                items, end = DECODER.raw_decode(text)
+            except ValueError:
+                continue
+            if items and end == len(text):
+                if opening == "{":
+                    data.update(items)
+                else:
+                    data.extend(items)
+                self.position = cut + 1
+                return True
+        return False
+
+    def parse_object(self, fields):
+        self.expect("{")
+        data = {}
+        if self.peek() == "}":
+            self.position += 1
+            return data
+        while True:
+            if self.peek() != '"':
+                self.error("Expected a key")
+            key = self.decode()
+            self.expect(":")
+            if key in fields:
+                data[key] = self.parse(fields[key])
+            else:
+                self.skip()
+
+            character = self.peek()
+            self.position += 1
+            if character == "}":
+                return data
+            if character != ",":
+                self.error("Expected ',' or '}'")
+
+    def parse_array(self, item_fields):
+        self.expect("[")
+        data = []
+        if self.peek() == "]":
+            self.position += 1
+            return data
+        while True:
+            data.append(self.parse(item_fields))
+
+            character = self.peek()
+            self.position += 1
+            if character == "]":
+                return data
+            if character != ",":
+                self.error("Expected ',' or ']'")
+
+    def skip(self):
+        """Skip the next value."""
+        character = self.peek()
+        if character == '"':
+            while not STRING.match(self.buffer, self.position):
+                if not self.fill():
+                    self.error("Unterminated string")
+            self.position = STRING.match(self.buffer, self.position).end()
+        elif character in "{[":
+            self.skip_container()
+        else:
+            # numbers, true, false and null
+            self.decode()
+
+    def skip_container(self):
+        """Skip an object or array, with everything inside it."""
+        depth = 0
+        while True:
+            self.position = SKIP.match(self.buffer, self.position).end()
+            if self.position == len(self.buffer) \
+               or self.buffer[self.position] == '"':
+                # the rest is in the next chunk, or a string is cut off
+                if not self.fill():
+                    self.error("Unexpected end of data")
+                continue
+
+            if self.buffer[self.position] in "{[":
+                depth += 1
+            else:
+                depth -= 1
+            self.position += 1
+            if not depth:
+                return
+
+def load(file_, fields):
+    """Return the wanted fields of the JSON document in a text file.
+
+    See Parser() for the format of "fields". If it's True, the whole
+    document is kept. Unlike json.load(), the file is never read
+    completely into memory, only one chunk or item at a time.
+    """
+    parser = Parser(file_)
+    if fields is True:
+        data = parser.stream()
+    else:
+        data = parser.parse(fields)
+    while True:
+        parser.position = WHITESPACE.match(
+            parser.buffer,
+            parser.position
+            ).end()
+        if parser.position < len(parser.buffer):
+            parser.error("Extra data")
+        if not parser.fill():
+            return data
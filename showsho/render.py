@@ -0,0 +1,118 @@
+# Showsho
+# Copyright (C) 2015-2016  Dino Duratović <dinomol at mail dot com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Turns the shows into the output printed by showsho.
+
+Every format is rendered into a single string, which is written at
+once. "table" is the human readable output, with colors unless they're
+turned off. The others are meant for other programs and have the same
+fields for every show (see get_fields()):
+
+    json    a JSON array with an object per show
+    jsonl   a JSON object per line
+    tsv     tab separated values, with a header line
+"""
+
+import datetime
+import json
+
+from showsho import show
+from showsho import utils
+
+FORMATS = ["table", "json", "jsonl", "tsv"]
+FIELDS = ["title", "status", "season", "episode", "premiere", "end"]
+# the statuses of the shows printed with the "airing" flag
+AIRING_STATUSES = ["airing", "soon", "new", "last"]
+
+def format_date(date):
+    """Return a date in ISO 8601 format, or None if it's unknown."""
+    if isinstance(date, datetime.date):
+        return date.isoformat()
+    return None
+
+def get_fields(s):
+    """Return a dictionary with the show's FIELDS.
+
+    The dates are ISO 8601 strings, the unknown values None.
+    """
+    return {
+        "title": s.title,
+        "status": s.status,
+        "season": s.season,
+        "episode": s.last_episode,
+        "premiere": format_date(s.premiere),
+        "end": format_date(s.end)
+        }
+
+def render_table(shows, color):
+    """Return a line with each show's status, lined up."""
+    # the longest title among the printed shows, in the class attribute
+    # "padding"
+    show.Show.padding = max(len(s.title) for s in shows)
+    return "".join(
+        "{}\n".format(utils.pretty_status(s, show.Show.padding, color))
+        for s in shows
+        )
+
+def render_json(shows, color):
+    """Return a JSON array with each show's fields."""
+    return "{}\n".format(json.dumps(
+        [get_fields(s) for s in shows],
+        ensure_ascii=False
+        ))
+
+def render_jsonl(shows, color):
+    """Return a line with a JSON object for each show."""
+    return "".join(
+        "{}\n".format(json.dumps(get_fields(s), ensure_ascii=False))
+        for s in shows
+        )
+
+def get_tsv_value(value):
+    """Return a value as a TSV field, empty for None."""
+    if value is None:
+        return ""
+    # a tab or line break would add a field or a line
+    return " ".join(str(value).split())
+
+def render_tsv(shows, color):
+    """Return a header line and a line with each show's fields."""
+    lines = ["\t".join(FIELDS)]
+    for s in shows:
+        fields = get_fields(s)
+        lines.append("\t".join(get_tsv_value(fields[f]) for f in FIELDS))
+    return "".join("{}\n".format(line) for line in lines)
+
+RENDERERS = {
+    "table": render_table,
+    "json": render_json,
+    "jsonl": render_jsonl,
+    "tsv": render_tsv
+    }
+
+def render(shows, airing=False, format_="table", color=True):
+    """Return the output for a list of Show() objects.
+
+    If "airing" is True, only the shows that are airing are included.
+    "format_" is one of FORMATS and "color" turns the colors of the
+    "table" format on or off. A table without shows is empty, the
+    other formats still have their header or empty array.
+    """
+    if airing:
+        shows = [s for s in shows if s.status in AIRING_STATUSES]
+    if not shows and format_ in ("table", "jsonl"):
+        return ""
+    return RENDERERS[format_](shows, color)
@@ -0,0 +1,149 @@
+# Showsho
+# Copyright (C) 2015-2016  Dino Duratović <dinomol at mail dot com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import datetime
+import time
+
+from showsho import show
+from showsho import cache
+
+# how long after the start of the day following an airdate the show is
+# checked, the episode has aired and TVMaze has its data by then
+AFTER_BROADCAST = datetime.timedelta(hours=6)
+# the longest time (in seconds) between two checks of a show whose
+# data can change, and of a show which has ended
+AIRING_INTERVAL = 604800
+ENDED_INTERVAL = 2592000
+# first and longest wait (in seconds) before checking a show again
+# which couldn't be found or updated
+BACKOFF = 3600
+MAX_BACKOFF = 604800
+
+def get_next_check(s, now):
+    """Return the time the show should be checked next.
+
+    In seconds since the epoch. A show that has ended (and can't
+    change anymore, see Show().is_stale()) is checked once a month.
+    The others the morning after their next known date (an episode,
+    the premiere or the finale) or after AIRING_INTERVAL, whichever
+    comes first. A show airing tonight is checked tomorrow morning.
+    """
+    if not s.is_stale():
+        return now + ENDED_INTERVAL
+
+    dates = [
+        date for date in (s.premiere, s.end)
+        if isinstance(date, datetime.date) and date >= show.TODAY
+        ]
+    yesterday = show.TODAY - datetime.timedelta(days=1)
+    next_episode = s.episodes.next_after(yesterday)
+    if next_episode:
+        dates.append(next_episode[1])
+
+    next_check = now + AIRING_INTERVAL
+    if dates:
+        day_after = min(dates) + datetime.timedelta(days=1)
+        after_broadcast = datetime.datetime.combine(
+            day_after,
+            datetime.time()
+            ) + AFTER_BROADCAST
+        next_check = min(next_check, after_broadcast.timestamp())
+    return next_check
+
+def get_backoff(misses):
+    """Return the seconds to wait after "misses" failed checks in a row."""
+    return min(MAX_BACKOFF, BACKOFF * 2 ** (misses - 1))
+
+class Schedule:
+    """Queue with the time every show should be checked next.
+
+    Decides which shows are due for an update, so regular runs (from
+    cron or the daemon) only download the shows which can have new
+    data instead of all of them. See get_next_check() for the times.
+    Shows which couldn't be found or updated are checked again with
+    an exponential backoff.
+
+    Kept in a JSON file inside the cache directory, as an object with
+    the normalized title as the key and {"next": time, "misses": n}
+    as the value. A show without an entry is due. Like TitleIndex(),
+    only the changed entries are written by save().
+    """
+    def __init__(self, cache_directory):
+        self.path = "{}/schedule.json".format(cache_directory)
+        self.entries = None
+        self.changed = {}
+
+    def load(self):
+        """Read the schedule file, if it wasn't read already."""
+        if self.entries is None:
+            self.entries = cache.read_json(self.path)
+
+    def get_next(self, title):
+        """Return the time the title is due, 0 if it was never checked."""
+        self.load()
+        entry = self.entries.get(cache.normalize_title(title), {})
+        return entry.get("next", 0)
+
+    def has_due(self, titles, now=None):
+        """Return True if any of the titles is due."""
+        if now is None:
+            now = time.time()
+        return any(self.get_next(title) <= now for title in titles)
+
+    def get_due(self, shows, now=None):
+        """Return a list with the due shows."""
+        if now is None:
+            now = time.time()
+        return [s for s in shows if self.get_next(s.title) <= now]
+
+    def get_next_time(self, shows):
+        """Return the time the first of the shows is due, or None."""
+        if not shows:
+            return None
+        return min(self.get_next(s.title) for s in shows)
+
+    def plan(self, shows, started):
+        """Set the next check of shows which were just checked.
+
+        "started" is the time the check started. The shows updated
+        since then get their next check from their new data, the others
+        (not found, or the update failed) are retried with a backoff.
+        """
+        self.load()
+        now = time.time()
+        for s in shows:
+            key = cache.normalize_title(s.title)
+            if s.synced >= int(started) and s.status != "Unknown":
+                entry = {"next": int(get_next_check(s, now)), "misses": 0}
+            else:
+                misses = self.entries.get(key, {}).get("misses", 0) + 1
+                entry = {
+                    "next": int(now + get_backoff(misses)),
+                    "misses": misses
+                    }
+            self.entries[key] = entry
+            self.changed[key] = entry
+
+    def save(self):
+        """Write the changed entries to the schedule file."""
+        if not self.changed:
+            return
+        entries = cache.read_json(self.path)
+        entries.update(self.changed)
+        cache.write_json(self.path, entries)
+
+        self.entries = entries
+        self.changed = {}
@@ -14,13 +14,128 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import json
 import datetime
+import time
+import array
+import bisect
 
 from showsho import utils
+from showsho import fetch
 
 API_URL = "http://api.tvmaze.com"
 TODAY = datetime.date.today()
+# for how many days after a season's end its data might still change
+RECENTLY_ENDED = datetime.timedelta(days=30)
+# periods (in seconds) the "updates" endpoint can be limited to
+UPDATE_PERIODS = [("day", 86400), ("week", 604800), ("month", 2592000)]
+# marks lazy attributes which haven't been determined yet
+UNPARSED = object()
+# the only fields of the API's responses Show() uses, the episodes'
+# summaries, images and links are skipped while parsing
+EPISODE_FIELDS = [{"season": True, "number": True, "airdate": True}]
+FIELDS = {
+    "id": True,
+    "updated": True,
+    "_embedded": {
+        "seasons": [{
+            "id": True,
+            "number": True,
+            "premiereDate": True,
+            "endDate": True,
+            "episodeOrder": True
+            }],
+        "episodes": EPISODE_FIELDS
+        }
+    }
+# how many more episodes than the current season's the show needs to
+# have before only the current season's episodes are downloaded, with
+# a second request (which costs about as much as this many episodes)
+TWO_STEP_EPISODES = 20
+
+class Timeline:
+    """Sorted timeline of a season's episodes.
+
+    Holds two arrays of the same length: the episodes' airdates as
+    ordinals and their numbers, sorted by airdate (and number). The
+    order the API or the cache lists the episodes in doesn't matter.
+    Looking up what airs on a date, the last aired and the next
+    episode is done with a binary search, which stays fast for daily
+    shows with thousands of episodes.
+
+    Unknown airdates have the ordinal 0, so they sort before all the
+    others.
+    """
+    __slots__ = ("ordinals", "numbers")
+
+    def __init__(self, ordinals=None, numbers=None):
+        self.ordinals = ordinals if ordinals is not None else array.array("l")
+        self.numbers = numbers if numbers is not None else array.array("l")
+
+    @classmethod
+    def from_dates(cls, episodes):
+        """Return a Timeline from a dictionary of dates.
+
+        Takes a dictionary with episode number and date object pairs.
+        Specials have no number, they're numbered 0.
+        """
+        pairs = []
+        for number, date in episodes.items():
+            if isinstance(date, datetime.date):
+                ordinal = date.toordinal()
+            else:
+                ordinal = 0
+            try:
+                number = int(number or 0)
+            except ValueError:
+                # older versions cached the specials under "null"
+                number = 0
+            pairs.append((ordinal, number))
+        pairs.sort()
+        return cls(
+            array.array("l", [ordinal for ordinal, number in pairs]),
+            array.array("l", [number for ordinal, number in pairs])
+            )
+
+    def __len__(self):
+        return len(self.ordinals)
+
+    def __repr__(self):
+        return "Timeline({})".format(list(self.items()))
+
+    def items(self):
+        """Yield episode number and date pairs ("" if it's unknown)."""
+        for ordinal, number in zip(self.ordinals, self.numbers):
+            if ordinal:
+                yield number, datetime.date.fromordinal(ordinal)
+            else:
+                yield number, ""
+
+    def airs_on(self, date):
+        """Return True if an episode airs on the date."""
+        ordinal = date.toordinal()
+        index = bisect.bisect_left(self.ordinals, ordinal)
+        return index < len(self.ordinals) and self.ordinals[index] == ordinal
+
+    def last_aired(self, date):
+        """Return the number of the last episode aired by the date."""
+        index = bisect.bisect_right(self.ordinals, date.toordinal())
+        if not index:
+            return None
+        return self.numbers[index - 1]
+
+    def next_after(self, date):
+        """Return a tuple with the next episode's number and date.
+
+        The first episode airing after the date, or None if there's
+        none known.
+        """
+        index = bisect.bisect_right(self.ordinals, date.toordinal())
+        if index == len(self.ordinals):
+            return None
+        return (
+            self.numbers[index],
+            datetime.date.fromordinal(self.ordinals[index])
+            )
 
 class Show:
     """Class containing everything needed to display a show.
@@ -32,10 +147,30 @@ class Show:
     Only the "title" is needed during instatiation and it's always
     available because it's in the text file passed to it. The other
     arguments are either read from the cached file or empty (None).
-
-    It creates the self.info and self.last_episode attributes,
-    but empty and gets the show's status based on the known information
-    (attributes).
+    "show_id" and "updated" are the show's TVMaze ID and the time
+    TVMaze last changed its data, "synced" the time showsho last
+    downloaded it. "etag" and "last_modified" are the validators
+    from the last response, sent with the next request so the API can
+    answer that nothing changed. "season_id" is the TVMaze ID of the
+    current season and "episode_count" the number of episodes in all
+    the seasons, used to choose how the show is downloaded (see
+    is_two_step()).
+
+    It creates the self.info attribute, but empty. It only holds the
+    API's response while the show is being updated, the needed fields
+    are extracted from it and the rest is freed right away. If the
+    Show.measure class attribute is True, the size of the API's
+    responses (the whole JSON documents, of which only the FIELDS were
+    kept) is saved in self.payload_size. The cached date
+    strings are kept as they are and only parsed the first time the
+    premiere, end or episodes are used. The status and last_episode
+    are also only determined when they're first used, based on the
+    known information (attributes), so shows which are never printed
+    don't cost anything. Setting any of the dates resets them.
+    The episodes are kept in a Timeline.
+
+    Instances have no __dict__, only the attributes in __slots__, to
+    keep long lists of shows small.
 
     The Show.delay class attribute is used to delay the airdates by
     1 day, which is useful in certain timezones. It's used in all
@@ -45,57 +180,253 @@ class Show:
     """
     padding = 0
     delay = False
-
-    def __init__(self, title, season, premiere, end, episodes):
+    measure = False
+
+    __slots__ = (
+        "title", "season", "show_id", "updated", "synced", "etag",
+        "last_modified", "season_id", "episode_count", "raw_premiere",
+        "raw_end", "raw_episodes", "_premiere", "_end", "_episodes",
+        "_status", "_last_episode", "info", "validators", "payload_size"
+        )
+
+    def __init__(self, title, season, premiere, end, episodes,
+                 show_id=None, updated=None, synced=0,
+                 etag=None, last_modified=None,
+                 season_id=None, episode_count=None):
         self.title = title
         self.season = season
-        self.premiere = utils.date_from_string(premiere, Show.delay)
-        self.end = utils.date_from_string(end, Show.delay)
-        self.episodes = self.episodes_to_date(episodes)
+        self.show_id = show_id
+        self.updated = updated
+        self.synced = synced
+        self.etag = etag
+        self.last_modified = last_modified
+        self.season_id = season_id
+        self.episode_count = episode_count
+        # the cached strings, parsed when they're first needed
+        self.raw_premiere = premiere
+        self.raw_end = end
+        self.raw_episodes = episodes
+        self._premiere = UNPARSED
+        self._end = UNPARSED
+        self._episodes = UNPARSED
+        self._status = UNPARSED
+        self._last_episode = UNPARSED
 
         self.info = None
-        self.last_episode = None
-        self.get_status()
-        self.get_last_episode()
+        self.validators = None
+        self.payload_size = 0
         # self.debug()
 
-    def fetch_show_info(self):
-        """Download information about the show.
+    @property
+    def premiere(self):
+        if self._premiere is UNPARSED:
+            self._premiere = utils.date_from_string(
+                self.raw_premiere, Show.delay)
+            self.raw_premiere = None
+        return self._premiere
+
+    @premiere.setter
+    def premiere(self, value):
+        self._premiere = value
+        self.reset_status()
+
+    @property
+    def end(self):
+        if self._end is UNPARSED:
+            self._end = utils.date_from_string(self.raw_end, Show.delay)
+            self.raw_end = None
+        return self._end
+
+    @end.setter
+    def end(self, value):
+        self._end = value
+        self.reset_status()
+
+    @property
+    def episodes(self):
+        if self._episodes is UNPARSED:
+            self._episodes = self.episodes_to_date(self.raw_episodes)
+            self.raw_episodes = None
+        return self._episodes
+
+    @episodes.setter
+    def episodes(self, value):
+        self._episodes = value
+        self.reset_status()
+
+    @property
+    def status(self):
+        if self._status is UNPARSED:
+            self.get_status()
+        return self._status
+
+    @status.setter
+    def status(self, value):
+        self._status = value
+
+    @property
+    def last_episode(self):
+        if self._last_episode is UNPARSED:
+            self._last_episode = None
+            self.get_last_episode()
+        return self._last_episode
+
+    @last_episode.setter
+    def last_episode(self, value):
+        self._last_episode = value
+
+    def reset_status(self):
+        """Determine the status and last episode again when next used."""
+        self._status = UNPARSED
+        self._last_episode = UNPARSED
+
+    def is_two_step(self):
+        """Return True if the show's episodes are fetched separately.
+
+        The "episodes" embedded in the show's information are the
+        episodes of every season, while only the current season's are
+        used. For shows with a long history (soaps, talk shows) it's
+        cheaper to download only the show with its seasons first and
+        then the current season's episodes, with a second request.
+        That's decided by the number of episodes the show had at its
+        last update, so the first download always embeds them all.
+        """
+        if self.show_id is None or self.episode_count is None:
+            return False
+        return self.episode_count - len(self.episodes) > TWO_STEP_EPISODES
 
-        Uses the TVMaze API to get various data about the show.
-        The main endpoint is "singlesearch", but with embedded
-        "season" and "episodes" information.
+    def get_query(self):
+        """Return the URL used to download information about the show.
 
-        If no show with the name can be found, self.info will be None.
+        If the show's TVMaze ID is known, the main endpoint is "shows",
+        otherwise the show is searched for by name with "singlesearch".
+        Both with embedded "season" and "episodes" information, or only
+        the "season" information if is_two_step().
         """
+        if self.is_two_step():
+            API_embedded = "embed[]=seasons"
+        else:
+            API_embedded = "embed[]=seasons&embed[]=episodes"
+        if self.show_id is not None:
+            return "{}/shows/{}?{}".format(API_URL, self.show_id, API_embedded)
+
         API_endpoint = "/singlesearch/shows?q="
-        API_embedded = "&embed[]=seasons&embed[]=episodes"
-        search_query = "{}{}{}{}".format(
+        search_query = "{}{}{}&{}".format(
             API_URL,
             API_endpoint,
             # replace space in name with plus sign for the URL
             self.title.replace(" ", "+"),
             API_embedded
             )
-        response = utils.get_URL_string(search_query)
-        if response:
-            self.info = json.loads(response)
+        return search_query
 
-    def get_season(self):
-        """Get the relevant season.
+    def get_episodes_query(self):
+        """Return the URL with the current season's episodes.
+
+        Used for the second request if is_two_step(), the season is
+        taken from self.info.
+        """
+        return "{}/seasons/{}/episodes".format(
+            API_URL,
+            self.get_current_season()["id"]
+            )
+
+    def needs_episodes(self):
+        """Return True if self.info doesn't have the episodes yet."""
+        return "episodes" not in self.info["_embedded"]
+
+    def get_headers(self):
+        """Return a dictionary with the conditional request headers.
+
+        Only if the show has cached data, which can be used if the API
+        answers with "304 Not Modified".
+        """
+        headers = {}
+        if self.season is None:
+            return headers
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+    def fetch_show_info(self):
+        """Download information about the show.
+
+        Uses the TVMaze API to get various data about the show.
+
+        If no show with the name can be found or it didn't change,
+        self.info will be None. Only the FIELDS are kept. If the
+        episodes weren't embedded, they are downloaded next.
+        """
+        response = fetch.fetch(self.get_query(), self.get_headers(), FIELDS)
+        self.load_info(response)
+        if self.info and self.needs_episodes():
+            response = fetch.fetch(
+                self.get_episodes_query(),
+                None,
+                EPISODE_FIELDS
+                )
+            self.load_episodes(response)
+
+    def load_info(self, response):
+        """Set self.info from the API's response.
+
+        Takes a fetch.Response. Only a successful response has the
+        show's information, in which case its validators are kept in
+        self.validators until update_from_info() saves them, once all
+        the data is in. With "304 Not Modified" the cached data is up
+        to date and there's nothing to parse.
+        """
+        if response.status == 200:
+            self.info = response.data
+            self.validators = (
+                response.headers.get("ETag"),
+                response.headers.get("Last-Modified")
+                )
+            if Show.measure:
+                self.payload_size = response.size
+
+    def load_episodes(self, response):
+        """Add the episodes from the second request to self.info.
+
+        Takes the fetch.Response with the current season's episodes.
+        If it wasn't successful, the show can't be updated and
+        self.info is set to None.
+        """
+        if response.status == 200:
+            self.info["_embedded"]["episodes"] = response.data
+            if Show.measure:
+                self.payload_size += response.size
+        else:
+            self.info = None
+
+    def get_current_season(self):
+        """Return the relevant season's information.
 
         Inside the "_embedded" data is information about the seasons.
         First we filter out the seasons list. Then we iterate through
         the list in reverse stopping at the first season which has
-        a "premiereDate". That season is the one we want and we get
-        its number.
+        a "premiereDate". That season is the one we want.
         """
         seasons = self.info["_embedded"]["seasons"]
         for season in reversed(seasons):
             if season["premiereDate"]:
-                current_season = season["number"]
-                break
-        self.season = int(current_season)
+                return season
+
+    def get_season(self):
+        """Get the relevant season's number and TVMaze ID.
+
+        Also counts the episodes of all the seasons, which decides
+        how the show is downloaded next time.
+        """
+        current_season = self.get_current_season()
+        self.season = int(current_season["number"])
+        self.season_id = current_season.get("id")
+        self.episode_count = sum(
+            season.get("episodeOrder") or 0
+            for season in self.info["_embedded"]["seasons"]
+            )
 
     def get_premiere(self):
         """Get the season's premiere date.
@@ -125,10 +456,10 @@ class Show:
         """Get the airing dates of the season's episodes.
 
         Inside the "_embedded" data is information about the episodes.
-        First we filter out the episodes list. Then we iterate through
-        the list in reverse, adding episode (key) and airing date
-        (value) pairs to the dictionary. We stop at the first episode
-        that's not part of our current season.
+        First we filter out the episodes list. Then we go through it,
+        adding episode (key) and airing date (value) pairs of the
+        current season to the dictionary, which is turned into a
+        Timeline. The API's order of the episodes doesn't matter.
 
         Example dictionary:
         {"1": "2016-05-05", "2": "2016-05-12"}
@@ -137,7 +468,7 @@ class Show:
         eps = self.info["_embedded"]["episodes"]
 
         episodes = {}
-        for epi in reversed(eps):
+        for epi in eps:
             if epi["season"] == self.season:
                 # sometimes the API has incomplete data and the airdate
                 # is just an empty string. self.episodes_to_date()
@@ -147,8 +478,6 @@ class Show:
                     episodes[epi["number"]] = self.end
                 else:
                     episodes[epi["number"]] = epi["airdate"]
-            else:
-                break
 
         self.episodes = self.episodes_to_date(episodes)
 
@@ -181,10 +510,9 @@ class Show:
 
         # if today's date is found inside a show's episode list
         # a new episode is out
-        if self.episodes:
-            if TODAY in self.episodes.values():
-                self.status = "new"
-                return
+        if self.episodes.airs_on(TODAY):
+            self.status = "new"
+            return
 
         if self.premiere:
             # if today's date is between the premiere and end date
@@ -201,58 +529,103 @@ class Show:
         # if the status couldn't be determined by now, it's Unknown
         self.status = "Unknown"
 
+    def has_changed(self, updates):
+        """Return True if TVMaze changed the show's data.
+
+        Takes the dictionary from the "updates" endpoint, with show IDs
+        (as strings) and the time each show was last updated. A show
+        whose ID isn't known yet is always considered changed.
+        """
+        if self.show_id is None:
+            return True
+        return updates.get(str(self.show_id), 0) > (self.updated or 0)
+
+    def has_data(self):
+        """Return False if the show was never downloaded.
+
+        Such a show only has its title. Shows cached by older versions
+        have no sync time, but they have a season.
+        """
+        return bool(self.synced) or self.season is not None
+
+    def is_stale(self):
+        """Return True if the show's data might have changed.
+
+        Uses the status determined from the cached data. Shows that
+        are airing, premiering soon or have a new episode out can get
+        new information, as can shows whose status is unknown.
+        A show which has ended doesn't change anymore, unless its
+        season ended recently (late episode data, news about the next
+        season).
+        """
+        if self.status != "ended":
+            return True
+        return TODAY - self.end <= RECENTLY_ENDED
+
     def episodes_to_date(self, dictionary):
-        """Returns a dictionary with proper dateobjects.
+        """Returns a Timeline with proper dateobjects.
 
         Takes a dictionary as an argument (the episodes dictionary
         which contains episode number and airing date pairs). Goes
-        through each date (which is a string in the initial dict) and
-        creates a dateobject from it. It appends each key,value pair
-        to a new dictionary and returns it.
+        through each date (which is a string in the initial dict,
+        unless it's a dateobject already) and creates a dateobject
+        from it. Returns a Timeline with all of them.
         """
         new_dictionary = {}
         for number, date in dictionary.items():
-            new_dictionary[number] = utils.date_from_string(date, Show.delay)
-        return new_dictionary
+            if not isinstance(date, datetime.date):
+                date = utils.date_from_string(date, Show.delay)
+            new_dictionary[number] = date
+        return Timeline.from_dates(new_dictionary)
 
-    def episodes_to_string(self, dictionary):
+    def episodes_to_string(self, timeline):
         """Returns a dictionary with strings from dateobjects.
 
         Does the opposite of episodes_to_date(). Used to create
-        strings from dateobjects, because json.dump() cannot serialize
-        dateobjects.
+        strings from the Timeline's dateobjects, because json.dump()
+        cannot serialize dateobjects.
         """
         new_dictionary = {}
-        for number, dateobject in dictionary.items():
-            new_dictionary[number] = utils.string_from_date(dateobject, Show.delay)
+        for number, dateobject in timeline.items():
+            if dateobject:
+                dateobject = utils.string_from_date(dateobject, Show.delay)
+            new_dictionary[number] = dateobject
         return new_dictionary
 
     def get_last_episode(self):
-        """Get the last aired episode."""
-        if not self.episodes:
-            return
-        # if the show has ended, the last episode's number will be
-        # the number of total episodes
-        if self.end < TODAY:
-            self.last_episode = len(self.episodes)
-            return
-        # goes through the episodes and the first episode who air date
-        # is "older" than today's date is the last aired one.
-        # this relies on that self.episodes is ordered (in reverse)
-        # still, just die in my sleep already
-        for ep, date in self.episodes.items():
-            if date <= TODAY:
-                self.last_episode = ep
-                return
+        """Get the last aired episode.
+
+        The last episode in the timeline which aired by today. Once
+        the show has ended, that's the season's last episode.
+        """
+        self.last_episode = self.episodes.last_aired(TODAY)
+
+    def get_next_episode(self):
+        """Return the next episode's number and date, or None."""
+        return self.episodes.next_after(TODAY)
 
     def update(self):
         """Updates the show's information from the web.
 
-        Runs the various methods which update the show's data.
+        Downloads the show's information and runs update_from_info().
         """
         self.fetch_show_info()
+        self.update_from_info()
+
+    def update_from_info(self):
+        """Updates the show's data from self.info.
+
+        Runs the various methods which update the show's data and
+        saves the response's validators. Then it frees self.info, since
+        everything needed was taken from it.
+        """
+        self.synced = int(time.time())
         if not self.info:
             return
+        self.etag, self.last_modified = self.validators
+        self.validators = None
+        self.show_id = self.info["id"]
+        self.updated = self.info["updated"]
         self.get_season()
         self.get_premiere()
         self.get_end()
@@ -260,20 +633,28 @@ class Show:
         # update the status according to the new data
         self.get_status()
         self.get_last_episode()
+        self.info = None
 
     def dump_data(self):
         """Return a dictionary with the show's data.
 
-        If there is no self.info, it dumps an "empty" dictionary
-        with only the show's title.
+        If the show couldn't be found (it has no season), it dumps an
+        "empty" dictionary with only the show's title.
         """
-        if not self.info:
+        if self.season is None:
             data_dict = {
                 "title": self.title,
                 "season": None,
                 "premiere": "",
                 "end": "",
-                "episodes": {}
+                "episodes": {},
+                "id": None,
+                "updated": None,
+                "synced": self.synced,
+                "etag": None,
+                "last_modified": None,
+                "season_id": None,
+                "episode_count": None
                 }
         else:
             data_dict = {
@@ -281,19 +662,30 @@ class Show:
                 "season": self.season,
                 "premiere": utils.string_from_date(self.premiere, Show.delay),
                 "end": utils.string_from_date(self.end, Show.delay),
-                "episodes": self.episodes_to_string(self.episodes)
+                "episodes": self.episodes_to_string(self.episodes),
+                "id": self.show_id,
+                "updated": self.updated,
+                "synced": self.synced,
+                "etag": self.etag,
+                "last_modified": self.last_modified,
+                "season_id": self.season_id,
+                "episode_count": self.episode_count
                 }
         return data_dict
 
     def debug(self):
         """Print all the attributes for debugging."""
         print("Title:\n\t{}".format(self.title))
+        print("ID:\n\t{}".format(self.show_id))
+        print("Updated:\n\t{}".format(self.updated))
         print("Season:\n\t{}".format(self.season))
         print("Premiere:\n\t{}".format(self.premiere))
         print("End:\n\t{}".format(self.end))
         print("Episodes:\n\t{}".format(self.episodes))
         print("Info:\n\t{}".format(self.info))
         print("Last episode:\n\t{}".format(self.last_episode))
+        print("Size:\n\t{} bytes".format(utils.get_size(self)))
+        print("API payload:\n\t{} bytes".format(self.payload_size))
 
 # see __init__.py download_shows() comment
 #    def check_episodes_download(self):
@@ -330,3 +722,16 @@ class Show:
 #                )
 #
 #        return new_episodes
+
+def get_updates_query(age):
+    """Return the URL listing the shows TVMaze updated recently.
+
+    The "updates" endpoint returns the IDs and update times of the
+    shows changed in the last day, week or month, or of all shows.
+    The shortest period that covers the last "age" seconds is used.
+    """
+    API_endpoint = "/updates/shows"
+    for period, seconds in UPDATE_PERIODS:
+        if age < seconds:
+            return "{}{}?since={}".format(API_URL, API_endpoint, period)
+    return "{}{}".format(API_URL, API_endpoint)
@@ -0,0 +1,425 @@
+# Showsho
+# Copyright (C) 2015-2016  Dino Duratović <dinomol at mail dot com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import array
+import bisect
+import datetime
+import json
+import mmap
+import os
+import struct
+import time
+
+from showsho import cache
+from showsho import utils
+from showsho import show
+
+MAGIC = b"SHOWSHO2"
+# magic, store version, number of shows, number of episodes
+HEADER = struct.Struct("=8sQII")
+# season, premiere, end, first episode, number of episodes, TVMaze ID,
+# updated, synced, then offset and length of the title, ETag and
+# Last-Modified strings
+RECORD = struct.Struct("=iIIIIqqqIIIIII")
+# default limits of the snapshots' total size (in bytes) and of the
+# time (in seconds) a snapshot is kept without being used
+MAX_SIZE = 67108864
+MAX_AGE = 7776000
+# a snapshot's access time is only saved again after this many seconds,
+# so the index isn't written on every run
+ACCESS_INTERVAL = 3600
+
+def get_path(cache_directory, file_hash):
+    """Return the snapshot's path for the show file's hash."""
+    return "{}/{}.snap".format(cache_directory, file_hash)
+
+def to_ordinal(date):
+    """Return a date's ordinal without the delay, or 0 if it's unknown."""
+    if not isinstance(date, datetime.date):
+        return 0
+    if show.Show.delay:
+        date = date - datetime.timedelta(days=1)
+    return date.toordinal()
+
+def from_ordinal(ordinal):
+    """Return a date (with the delay) from an ordinal, or "" for 0."""
+    if not ordinal:
+        return ""
+    date = datetime.date.fromordinal(ordinal)
+    if show.Show.delay:
+        date = date + datetime.timedelta(days=1)
+    return date
+
+def write(path, shows, version):
+    """Write a snapshot with the shows' data.
+
+    "version" is the version of the store the data comes from. It's
+    written to a temporary file first and then renamed.
+    """
+    records = bytearray()
+    numbers = array.array("i")
+    dates = array.array("I")
+    strings = bytearray()
+
+    def add_string(string):
+        offset = len(strings)
+        if string:
+            strings.extend(string.encode())
+        return offset, len(strings) - offset
+
+    for s in shows:
+        episodes_offset = len(numbers)
+        for number, date in s.episodes.items():
+            numbers.append(number)
+            dates.append(to_ordinal(date))
+
+        records.extend(RECORD.pack(
+            -1 if s.season is None else s.season,
+            to_ordinal(s.premiere),
+            to_ordinal(s.end),
+            episodes_offset,
+            len(numbers) - episodes_offset,
+            -1 if s.show_id is None else s.show_id,
+            -1 if s.updated is None else s.updated,
+            s.synced,
+            *add_string(s.title),
+            *add_string(s.etag),
+            *add_string(s.last_modified)
+            ))
+
+    temporary_path = "{}.tmp".format(path)
+    with open(temporary_path, "wb") as file_:
+        file_.write(HEADER.pack(MAGIC, version, len(shows), len(numbers)))
+        file_.write(records)
+        file_.write(numbers.tobytes())
+        file_.write(dates.tobytes())
+        file_.write(strings)
+    os.replace(temporary_path, path)
+
+class Snapshot:
+    """A memory-mapped snapshot file.
+
+    A snapshot holds the data of every show in one show file, in the
+    same order, so showsho can start without parsing the JSON cache
+    and every date string in it. Snapshots are named after the show
+    file's hash and remember the version of the store they were made
+    from, if the store changed since then they aren't used.
+
+    The file has the following layout, with all numbers in native byte
+    order (snapshots aren't meant to be copied to other machines):
+
+        header    magic, store version, number of shows and episodes
+        records   one fixed-size record per show
+        numbers   every show's episode numbers, packed int32
+        dates     every show's episode airdates, packed uint32, each
+                  show's episodes in the order of its Timeline
+        strings   UTF-8 titles and validators used by the records
+
+    Dates are stored as ordinals (0 when unknown), without the delay
+    added. Records are read straight from the mapped file. get_show()
+    turns a single record into a Show() object, is_airing() checks
+    whether a show might be airing using only the stored ordinals.
+    """
+    def __init__(self, path):
+        with open(path, "rb") as file_:
+            self.map = mmap.mmap(file_.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.version, self.count, episodes = HEADER.unpack_from(
+            self.map
+            )
+        if magic != MAGIC:
+            raise ValueError("{} isn't a showsho snapshot".format(path))
+
+        view = memoryview(self.map)
+        offset = HEADER.size + self.count * RECORD.size
+        self.numbers = view[offset:offset + episodes * 4].cast("i")
+        offset += episodes * 4
+        self.dates = view[offset:offset + episodes * 4].cast("I")
+        self.strings = offset + episodes * 4
+
+    def __len__(self):
+        return self.count
+
+    def get_record(self, index):
+        """Return a tuple with the record's fields."""
+        return RECORD.unpack_from(self.map, HEADER.size + index * RECORD.size)
+
+    def has_data(self):
+        """Return False if any of the shows was never downloaded.
+
+        See Show().has_data().
+        """
+        records = self.map[HEADER.size:HEADER.size + self.count * RECORD.size]
+        return not any(
+            record[7] == 0 and record[0] == -1
+            for record in RECORD.iter_unpack(records)
+            )
+
+    def get_string(self, offset, length):
+        """Return a string from the strings area or None if it's empty."""
+        if not length:
+            return None
+        start = self.strings + offset
+        return self.map[start:start + length].decode()
+
+    def is_airing(self, index, today):
+        """Return True if the show might be airing.
+
+        "today" is the ordinal of today's date without the delay.
+        The same conditions as in cache.SQLiteStore().get_airing().
+        """
+        record = self.get_record(index)
+        premiere, end, first, count = record[1:5]
+        if end >= today or premiere > today:
+            return True
+        dates = self.dates[first:first + count]
+        index = bisect.bisect_left(dates, today)
+        return index < count and dates[index] == today
+
+    def get_show(self, index):
+        """Return a Show() object from the record."""
+        (season, premiere, end, first, count, show_id, updated, synced,
+         title_offset, title_length, etag_offset, etag_length,
+         modified_offset, modified_length) = self.get_record(index)
+
+        s = show.Show(
+            self.get_string(title_offset, title_length) or "",
+            None if season == -1 else season,
+            "",
+            "",
+            {},
+            None if show_id == -1 else show_id,
+            None if updated == -1 else updated,
+            synced,
+            self.get_string(etag_offset, etag_length),
+            self.get_string(modified_offset, modified_length)
+            )
+        # the dates are set directly, there are no strings to parse. the
+        # status is determined from them when it's first used
+        s.premiere = from_ordinal(premiere)
+        s.end = from_ordinal(end)
+        ordinals = array.array("l", self.dates[first:first + count])
+        if show.Show.delay:
+            ordinals = array.array("l", [o + 1 if o else 0 for o in ordinals])
+        s.episodes = show.Timeline(
+            ordinals,
+            array.array("l", self.numbers[first:first + count])
+            )
+        return s
+
+    def get_shows(self, airing=False):
+        """Return a list of Show() objects.
+
+        If "airing" is True, only the shows that might be airing are
+        turned into Show() objects.
+        """
+        if not airing:
+            return [self.get_show(i) for i in range(self.count)]
+        today = to_ordinal(show.TODAY)
+        return [
+            self.get_show(i) for i in range(self.count)
+            if self.is_airing(i, today)
+            ]
+
+def load(path, version):
+    """Return the Snapshot at "path" or None.
+
+    None if there's no snapshot yet, if it can't be read, if it's
+    stale (was made from another version of the store) or if some of
+    its shows were never downloaded, which has to be tried again.
+    """
+    try:
+        snapshot = Snapshot(path)
+    except (OSError, ValueError, struct.error):
+        return None
+    if snapshot.version != version or not snapshot.has_data():
+        return None
+    return snapshot
+
+def convert(json_path, snapshot_path, version):
+    """Convert a JSON cache file into a snapshot.
+
+    Takes either the list of shows cached by older versions or the
+    object with all the shows of the shows.json store.
+    """
+    with open(json_path, "r") as file_:
+        json_data = json.load(file_)
+    if isinstance(json_data, dict):
+        json_data = json_data.values()
+
+    shows = [utils.show_from_data(data["title"], data) for data in json_data]
+    write(snapshot_path, shows, version)
+
+class SnapshotIndex:
+    """Index of the snapshots in the cache directory.
+
+    Editing a show file changes its hash, which leaves the snapshot of
+    the old version behind. The index remembers which show files use
+    every snapshot and when it was last used, so those can be removed:
+    when a show file gets a new snapshot, the snapshots no other show
+    file uses are removed right away. evict() removes the least
+    recently used snapshots above a size limit and the ones unused for
+    longer than an age limit, collect() also finds the snapshots
+    missing from the index and the ones of show files which were
+    removed. Snapshots are looked up by their path, only collect()
+    lists the cache directory.
+
+    Kept in a JSON file inside the cache directory, as an object with
+    the snapshot's file name as the key and {"accessed": time, "size":
+    bytes, "files": [show file paths]} as the value. Like TitleIndex(),
+    only the changed entries are written by save().
+    """
+    def __init__(self, cache_directory):
+        self.cache_directory = cache_directory
+        self.path = "{}/snapshots.json".format(cache_directory)
+        self.entries = None
+        self.changed = {}
+
+    def load(self):
+        """Read the index file, if it wasn't read already."""
+        if self.entries is None:
+            self.entries = cache.read_json(self.path)
+
+    def set(self, name, entry):
+        """Set the snapshot's entry in the index."""
+        self.load()
+        self.entries[name] = entry
+        self.changed[name] = entry
+
+    def add(self, snapshot_path, file_path, now=None):
+        """Save that the show file uses the snapshot, which was just used.
+
+        The snapshots other versions of the show file used are removed,
+        unless another show file still uses them.
+        """
+        if now is None:
+            now = time.time()
+        self.load()
+        name = os.path.basename(snapshot_path)
+        file_path = os.path.realpath(file_path)
+        for other_name, entry in list(self.entries.items()):
+            if other_name == name or not entry \
+               or file_path not in entry["files"]:
+                continue
+            files = [path for path in entry["files"] if path != file_path]
+            if files:
+                self.set(other_name, dict(entry, files=files))
+            else:
+                self.remove(other_name)
+
+        entry = self.entries.get(name)
+        files = entry["files"] if entry else []
+        if file_path not in files:
+            files = files + [file_path]
+        self.set(name, {
+            "accessed": int(now),
+            "size": os.stat(snapshot_path).st_size,
+            "files": files
+            })
+
+    def touch(self, snapshot_path, file_path, now=None):
+        """Save that the show file's snapshot was used.
+
+        Only changes the index if the access time is older than
+        ACCESS_INTERVAL or the snapshot isn't indexed for the file yet.
+        """
+        if now is None:
+            now = time.time()
+        self.load()
+        entry = self.entries.get(os.path.basename(snapshot_path))
+        if entry and os.path.realpath(file_path) in entry["files"] \
+           and now - entry["accessed"] < ACCESS_INTERVAL:
+            return
+        self.add(snapshot_path, file_path, now)
+
+    def remove(self, name):
+        """Remove the snapshot and its entry."""
+        try:
+            os.remove("{}/{}".format(self.cache_directory, name))
+        except FileNotFoundError:
+            pass
+        self.set(name, None)
+
+    def evict(self, max_size=MAX_SIZE, max_age=MAX_AGE, now=None):
+        """Remove the snapshots over the limits, return their names.
+
+        The snapshots unused for more than "max_age" seconds are
+        removed, then the least recently used ones until they take up
+        at most "max_size" bytes. The most recently used snapshot is
+        always kept.
+        """
+        if now is None:
+            now = time.time()
+        self.load()
+        entries = sorted(
+            (entry["accessed"], name, entry["size"])
+            for name, entry in self.entries.items() if entry
+            )
+        total_size = sum(size for accessed, name, size in entries)
+        removed = []
+        for accessed, name, size in entries[:-1]:
+            if now - accessed <= max_age and total_size <= max_size:
+                break
+            self.remove(name)
+            removed.append(name)
+            total_size -= size
+        return removed
+
+    def collect(self, max_size=MAX_SIZE, max_age=MAX_AGE, now=None):
+        """Remove the unused snapshots, return their names.
+
+        Those are the ones not in the index (made by older versions, or
+        left behind by a show file's previous versions), the ones whose
+        show files don't exist anymore and the ones over the limits,
+        see evict(). Also removes the temporary files left by
+        interrupted writes.
+        """
+        self.load()
+        removed = []
+        for file_name in os.listdir(self.cache_directory):
+            if file_name.endswith(".snap.tmp") or (
+                    file_name.endswith(".snap")
+                    and file_name not in self.entries
+                    ):
+                self.remove(file_name)
+                removed.append(file_name)
+
+        for name, entry in list(self.entries.items()):
+            if not entry:
+                continue
+            files = [path for path in entry["files"] if os.path.exists(path)]
+            if not files:
+                self.remove(name)
+                removed.append(name)
+            elif files != entry["files"]:
+                self.set(name, dict(entry, files=files))
+        return removed + self.evict(max_size, max_age, now)
+
+    def save(self):
+        """Write the changed entries to the index file.
+
+        The file is read again before writing, so entries saved by
+        another showsho process in the meantime aren't lost. Removed
+        entries are left out.
+        """
+        if not self.changed:
+            return
+        entries = cache.read_json(self.path)
+        entries.update(self.changed)
+        entries = {k: v for k, v in entries.items() if v is not None}
+        cache.write_json(self.path, entries)
+
+        self.entries = entries
+        self.changed = {}
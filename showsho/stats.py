@@ -0,0 +1,191 @@
+# Showsho
+# Copyright (C) 2015-2016  Dino Duratović <dinomol at mail dot com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import contextlib
+import cProfile
+import json
+import sys
+import time
+import tracemalloc
+
+# version of the report's format, changed when fields are changed or
+# removed (not when they're added)
+REPORT_VERSION = 2
+
+def get_percentile(values, percentile):
+    """Return the value below which "percentile" % of the values are."""
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[round(percentile / 100 * (len(values) - 1))]
+
+class Stats:
+    """Collects timings and counters about a showsho run.
+
+    Disabled until start() is called, after which the other modules
+    report to it: the wall time of every phase of the run, every HTTP
+    request (its status, time, the time spent reading the response's
+    body from the socket and parsing it, and the number of bytes
+    received) and counters like the cache hits and
+    misses. With a "profile_path", the run is also profiled with
+    cProfile and tracemalloc.
+
+    stop() writes a JSON report, see get_report(). The requests are
+    recorded from the fetch module's threads, which only append to a
+    list.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.started = None
+        self.start_time = None
+        self.phases = {}
+        self.counters = {}
+        self.requests = []
+        self.profiler = None
+
+    def start(self, profile_path=None):
+        """Start collecting and profiling if there's a "profile_path"."""
+        self.enabled = True
+        self.started = time.time()
+        self.start_time = time.perf_counter()
+        if profile_path:
+            tracemalloc.start()
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Context manager adding the time spent in it to a phase."""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = (
+                self.phases.get(name, 0) + time.perf_counter() - start
+                )
+
+    def count(self, name, amount=1):
+        """Add "amount" to a counter."""
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def add_request(self, path, status, seconds, read_seconds,
+                    parse_seconds, size):
+        """Record an HTTP request."""
+        if self.enabled:
+            self.requests.append({
+                "path": path,
+                "status": status,
+                "seconds": round(seconds, 6),
+                "read_seconds": round(read_seconds, 6),
+                "parse_seconds": round(parse_seconds, 6),
+                "bytes": size
+                })
+
+    def get_report(self):
+        """Return a dictionary with everything collected.
+
+        "phases" has the seconds spent in every phase, "counters" the
+        counters and "requests" every request, with a summary of them
+        in "fetch". Times are in seconds, sizes in bytes.
+        """
+        seconds = [request["seconds"] for request in self.requests]
+        report = {
+            "version": REPORT_VERSION,
+            "started": self.started,
+            "seconds": round(time.perf_counter() - self.start_time, 6),
+            "phases": {
+                name: round(value, 6) for name, value in self.phases.items()
+                },
+            "counters": self.counters,
+            "fetch": {
+                "requests": len(self.requests),
+                "bytes": sum(request["bytes"] for request in self.requests),
+                "read_seconds": round(sum(
+                    request["read_seconds"] for request in self.requests
+                    ), 6),
+                "parse_seconds": round(sum(
+                    request["parse_seconds"] for request in self.requests
+                    ), 6),
+                "p50_seconds": get_percentile(seconds, 50),
+                "p99_seconds": get_percentile(seconds, 99)
+                },
+            "requests": self.requests
+            }
+        if tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            report["memory"] = {"current_bytes": current, "peak_bytes": peak}
+        return report
+
+    def stop(self, stats_path=None, profile_path=None):
+        """Stop collecting and write the report and profiles.
+
+        The JSON report is written to "stats_path", or to stderr if
+        it's "-". The cProfile statistics are written to
+        "profile_path" (they can be read with the pstats module) and
+        the tracemalloc snapshot next to it, with a ".tracemalloc"
+        suffix (read with tracemalloc.Snapshot.load()).
+        """
+        if self.profiler:
+            self.profiler.disable()
+            self.profiler.dump_stats(profile_path)
+        report = self.get_report()
+        if tracemalloc.is_tracing():
+            tracemalloc.take_snapshot().dump(
+                "{}.tracemalloc".format(profile_path)
+                )
+            tracemalloc.stop()
+        self.enabled = False
+
+        if stats_path == "-":
+            json.dump(report, sys.stderr)
+            sys.stderr.write("\n")
+        elif stats_path:
+            with open(stats_path, "w") as file_:
+                json.dump(report, file_)
+
+# the Stats() every module reports to
+recorder = Stats()
+
+def start(profile_path=None):
+    """Start collecting, see Stats().start()."""
+    recorder.start(profile_path)
+
+def stop(stats_path=None, profile_path=None):
+    """Stop collecting and write the report, see Stats().stop()."""
+    recorder.stop(stats_path, profile_path)
+
+def phase(name):
+    """Return a context manager timing a phase of the run."""
+    return recorder.phase(name)
+
+def count(name, amount=1):
+    """Add "amount" to a counter."""
+    recorder.count(name, amount)
+
+def add_request(path, status, seconds, read_seconds, parse_seconds, size):
+    """Record an HTTP request."""
+    recorder.add_request(
+        path,
+        status,
+        seconds,
+        read_seconds,
+        parse_seconds,
+        size
+        )
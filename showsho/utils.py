@@ -19,11 +19,14 @@ import os
 import os.path
 import urllib.request
 import datetime
-import json
 import re
+import sys
 
 from showsho import show
 
+# bytes read at a time when hashing a file
+HASH_CHUNK_SIZE = 65536
+
 HEADER = {"User-Agent": "Mozilla/5.0 (X11; Linux x86_64; rv:48.0) Gecko/20100101 Firefox/48.0"}
 
 class Color:
@@ -54,12 +57,27 @@ def get_cache_dir():
     full_dir = "{}/showsho".format(base_dir)
     return full_dir
 
-def get_file_hash(file_path):
-    """Return the provided file's SHA1 hash."""
-    file_ = open(file_path, "rb")
+def get_file_hash(file_path, fingerprints=None):
+    """Return the provided file's SHA1 hash.
+
+    The file is read in chunks of HASH_CHUNK_SIZE bytes. If a
+    cache.FingerprintIndex() is passed, the hash saved in it is
+    returned when the file didn't change, and a new hash is saved.
+    """
+    if fingerprints is not None:
+        file_hash, fingerprint = fingerprints.get(file_path)
+        if file_hash:
+            return file_hash
+
     hash_ = hashlib.sha1()
-    hash_.update(file_.read())
-    return hash_.hexdigest()
+    with open(file_path, "rb") as file_:
+        for chunk in iter(lambda: file_.read(HASH_CHUNK_SIZE), b""):
+            hash_.update(chunk)
+    file_hash = hash_.hexdigest()
+
+    if fingerprints is not None:
+        fingerprints.set(file_path, fingerprint, file_hash)
+    return file_hash
 
 def get_lines_from_file(file_path):
     """Return the file's content as lines contained in a list."""
@@ -69,60 +87,41 @@ def get_lines_from_file(file_path):
         _list.append(line.strip())
     return _list
 
-def check_cached(file_hash, cache_directory):
-    """Check if cached version of file exists.
+def show_from_data(title, data):
+    """Return a showsho.show.Show() object from cached data.
 
-    Look in the cache_directory to see if a file with the provided
-    hash exists.
+    Takes the show's title (as written in the show file) and a
+    dictionary with the show's data, as returned by Show().dump_data().
     """
-    files_in_cache = os.listdir(cache_directory)
-    if file_hash in files_in_cache:
-        return True
-    else:
-        return False
+    return show.Show(
+        title,
+        data["season"],
+        data["premiere"],
+        data["end"],
+        data["episodes"],
+        # not saved by older versions
+        data.get("id"),
+        data.get("updated"),
+        data.get("synced", 0),
+        data.get("etag"),
+        data.get("last_modified"),
+        data.get("season_id"),
+        data.get("episode_count")
+        )
 
-def shows_from_cache(file_path):
-    """Return list of showsho.show.Show() objects from cache.
+def show_from_scratch(title):
+    """Return a showsho.show.Show() object for the first time.
 
-    Gets data for shows from a cached file. Uses that data to create
-    Show() objects for each and returns a list containing a Show()
-    object for every show in the cache file.
-    """
-    file_ = open(file_path, "r")
-    json_data = json.load(file_)
-
-    shows = []
-    for s in json_data:
-        shows.append(show.Show(
-            s["title"],
-            s["season"],
-            s["premiere"],
-            s["end"],
-            s["episodes"]
-            ))
-
-    return shows
-
-def shows_from_scratch(file_path):
-    """Return a list of showsho.show.Show() objects for the first time.
-
-    Gets a list of show names from a file. Then it creates Show()
-    objects for every show in the list with no information except
-    the show's name.
+    Creates a Show() object with no information except the show's
+    name.
     """
-    show_names = get_lines_from_file(file_path)
-
-    shows = []
-    for s in show_names:
-        shows.append(show.Show(
-            s,
-            None,
-            "",
-            "",
-            {}
-            ))
-
-    return shows
+    return show.Show(
+        title,
+        None,
+        "",
+        "",
+        {}
+        )
 
 def get_URL_string(url):
     """Return a string with the content of an URL."""
@@ -133,6 +132,34 @@ def get_URL_string(url):
     except urllib.error.HTTPError:
         return None
 
+def get_size(obj, seen=None):
+    """Return the approximate memory used by an object, in bytes.
+
+    Adds up the sizes of the object and everything it references:
+    the items of containers and the attributes of objects (with
+    __slots__ or a __dict__). Objects referenced more than once are
+    only counted once, class attributes aren't counted.
+    """
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            size += get_size(key, seen) + get_size(value, seen)
+    elif isinstance(obj, (list, tuple, set)):
+        for item in obj:
+            size += get_size(item, seen)
+    elif hasattr(obj, "__slots__"):
+        for name in obj.__slots__:
+            size += get_size(getattr(obj, name, None), seen)
+    elif hasattr(obj, "__dict__"):
+        size += get_size(obj.__dict__, seen)
+    return size
+
 def get_choice(length):
     """Return user's chosen number, with input validation for a range."""
     while True:
@@ -174,86 +201,73 @@ def string_from_date(dateobject, delay):
     else:
         return dateobject.isoformat()
 
-def save_data(data, file_hash, cache_dir):
-    """Save data to the cache directory.
+def pad_title(title, padding, color=None):
+    """Return the title padded to "padding" characters.
 
-    Takes a list with dictionaries for each show and writes it
-    to a file in JSON format. Uses the file's hash as the filename
-    and saves it in the cache directory.
+    If a color is passed, only the title is colorized, the padding is
+    added after the escape codes so they don't count towards it.
     """
-    file_ = open("{}/{}".format(cache_dir, file_hash), "w")
-    json.dump(data, file_, ensure_ascii=False, indent=0)
+    spaces = " " * (padding - len(title))
+    if color:
+        title = colorize(title, color)
+    return "{}{}".format(title, spaces)
 
-def pretty_status(show, padding):
+def pretty_status(show, padding, color=True):
     """Return a nicely formatted string with info.
 
     Takes a Show() object instance as argument and returns a string
     containing information about the show depending on its status.
     Adds padding to the title to line shows up. The padding value
-    is calculated during Show() object instantiation. Adding an
-    additional padding of 9 to compensate for the fact that
-    Python also "print" the color escape codes.
+    is the length of the longest printed title. If "color" is False,
+    no color escape codes are used.
     """
+    def paint(text, color_code):
+        return colorize(text, color_code) if color else text
+
     if show.status == "airing":
-        return "{:<{}} | S{}E{} | {}".format(
-            colorize(show.title, Color.GREEN),
-            padding + 9,
+        return "{} | S{}E{} | {}".format(
+            pad_title(show.title, padding, color and Color.GREEN),
             format_number(show.season),
             format_number(show.last_episode),
             show.premiere.strftime("%a")
             )
 
     elif show.status == "soon":
-        return "{:<{}} | Season {} premiere on {}".format(
-            colorize(show.title, Color.ORANGE),
-            padding + 9,
+        return "{} | Season {} premiere on {}".format(
+            pad_title(show.title, padding, color and Color.ORANGE),
             format_number(show.season),
             show.premiere.strftime("%a, %d %b %Y")
             )
 
     elif show.status == "ended":
-        return "{:<{}} | Last episode S{}E{}".format(
-            show.title,
-            padding,
+        return "{} | Last episode S{}E{}".format(
+            pad_title(show.title, padding),
             format_number(show.season),
             format_number(show.last_episode)
             )
 
     elif show.status == "new":
-        return "{:<{}} | S{}E{} | {}".format(
-            colorize(show.title, Color.GREEN),
-            padding + 9,
+        return "{} | S{}E{} | {}".format(
+            pad_title(show.title, padding, color and Color.GREEN),
             format_number(show.season),
             format_number(show.last_episode),
-            colorize("New Episode!", Color.L_BLUE)
+            paint("New Episode!", Color.L_BLUE)
             )
 
     elif show.status == "last":
-        return "{:<{}} | S{}E{} | {}".format(
-            colorize(show.title, Color.GREEN),
-            padding + 9,
+        return "{} | S{}E{} | {}".format(
+            pad_title(show.title, padding, color and Color.GREEN),
             format_number(show.season),
             format_number(show.last_episode),
-            colorize("Last episode!", Color.L_RED)
+            paint("Last episode!", Color.L_RED)
             )
 
     elif show.status == "Unknown":
         return "{} - {}".format(
-            colorize(show.title, Color.L_RED),
+            paint(show.title, Color.L_RED),
             "not found. Please check the show's name"
             )
 
-def check_connection():
-    """Return True if connected to the internet.
-
-    Uses Google(tm) to check for connectivity.
-    """
-    try:
-        urllib.request.urlopen("http://www.google.com")
-        return True
-    except urllib.error.URLError:
-        return False
-
 # see __init__.py download_shows() comment
 #def get_torrents(title, season, episode):
 #    """Return a list with torrent data tuples.
@@ -0,0 +1,132 @@
+# Showsho
+# Copyright (C) 2015-2016  Dino Duratović <dinomol at mail dot com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import io
+import json
+import unittest
+
+from showsho import projection
+from showsho import show
+
+# a show like the ones from the API, with every kind of value in the
+# parts that are kept and in the parts that are skipped
+SHOW = {
+    "id": 1,
+    "weight": 12.5,
+    "rating": {"average": -7.25e-3},
+    "updated": 1500000000,
+    "summary": "<p>A \"quoted\" \\ summary, with {brackets} and [más]</p>",
+    "genres": ["Drama", "Crime"],
+    "network": None,
+    "_embedded": {
+        "seasons": [
+            {
+                "id": 10,
+                "number": 1,
+                "premiereDate": "2016-01-01",
+                "endDate": None,
+                "episodeOrder": 10,
+                "image": {"medium": "http://localhost/1.jpg"},
+                "score": 1E+2
+                },
+            {"id": 11, "number": 2, "premiereDate": None, "endDate": None,
+             "episodeOrder": None}
+            ],
+        "episodes": [
+            {"season": 1, "number": n, "airdate": "2016-01-0{}".format(n),
+             "runtime": 60.0, "rating": {"average": 8.5},
+             "summary": "x" * n}
+            for n in range(1, 8)
+            ]
+        }
+    }
+
+def project(data, fields):
+    """Return what Parser() should keep of the decoded data."""
+    if fields is True:
+        return data
+    if isinstance(fields, dict) and isinstance(data, dict):
+        return {
+            key: project(data[key], key_fields)
+            for key, key_fields in fields.items() if key in data
+            }
+    if isinstance(fields, list) and isinstance(data, list):
+        return [project(item, fields[0]) for item in data]
+    return data
+
+class ChunkBoundaryTest(unittest.TestCase):
+    """Parses documents read in chunks of every small size.
+
+    Every value, including the numbers, is split at every possible
+    position by one of the sizes.
+    """
+    def setUp(self):
+        self.chunk_size = projection.CHUNK_SIZE
+
+    def tearDown(self):
+        projection.CHUNK_SIZE = self.chunk_size
+
+    def check(self, text, fields):
+        expected = project(json.loads(text), fields)
+        for size in range(1, 40):
+            projection.CHUNK_SIZE = size
+            with self.subTest(chunk_size=size):
+                data = projection.load(io.StringIO(text), fields)
+                self.assertEqual(data, expected)
+
+    def test_show(self):
+        for indent in (None, 2):
+            self.check(json.dumps(SHOW, indent=indent), show.FIELDS)
+
+    def test_episodes(self):
+        text = json.dumps(SHOW["_embedded"]["episodes"])
+        self.check(text, show.EPISODE_FIELDS)
+
+    def test_split_float(self):
+        text = '{"weight": 12.5, "id": 1}'
+        for fields in ({"weight": True, "id": True}, {"id": True, "x": {}}):
+            self.check(text, fields)
+
+    def test_split_exponent(self):
+        self.check('{"a": 1e10, "b": -2.5E-3, "c": [1, 2.0]}', {"c": True})
+        self.check('{"a": 1e10, "b": -2.5E-3}', {"a": True, "b": {}})
+
+    def test_scalar_document(self):
+        self.check("123.456e7", {"id": True})
+
+    def test_whole_document(self):
+        updates = {str(n): 1500000000 + n for n in range(50)}
+        for data in (SHOW, [SHOW, SHOW], updates, {}, [], [[]], 1.5):
+            self.check(json.dumps(data), True)
+        # commas and the items' last characters inside strings and
+        # nested containers
+        data = [
+            {"a": {"b": n}, "c": [{"d": 1}, {"e": "},"}]} for n in range(9)
+            ]
+        self.check(json.dumps(data), True)
+
+    def test_invalid(self):
+        for text in ('{"id": 1', '{"id": 1,}', '{"id": 12.}', '{"id": 1} 2'):
+            with self.subTest(text=text):
+                with self.assertRaises(ValueError):
+                    projection.load(io.StringIO(text), {"id": True, "x": {}})
+        for text in ('{"id": 1,, "x": 2}', '[1 2]', '{"id" 1}', '[1, 2'):
+            with self.subTest(text=text):
+                with self.assertRaises(ValueError):
+                    projection.load(io.StringIO(text), True)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+# Showsho
+# Copyright (C) 2015-2016  Dino Duratović <dinomol at mail dot com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import datetime
+import json
+import os
+import tempfile
+import unittest
+
+from showsho import snapshot
+
+# a show cached by older versions, which saved the specials (episodes
+# with no number) under "null"
+LEGACY_SHOW = {
+    "title": "Legacy Show",
+    "season": 3,
+    "premiere": "2026-09-01",
+    "end": "2026-10-20",
+    "episodes": {
+        "1": "2026-09-01",
+        "2": "2026-09-08",
+        "null": "2026-09-20",
+        "3": ""
+        }
+    }
+
+class LegacyCacheTest(unittest.TestCase):
+    """Converts the cache file of an older version into a snapshot."""
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.json_path = os.path.join(self.directory.name, "0" * 40)
+        self.snapshot_path = snapshot.get_path(self.directory.name, "0" * 40)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_special(self):
+        with open(self.json_path, "w") as file_:
+            json.dump([LEGACY_SHOW], file_)
+        snapshot.convert(self.json_path, self.snapshot_path, 1)
+
+        shows = snapshot.load(self.snapshot_path, 1).get_shows()
+        self.assertEqual(len(shows), 1)
+        self.assertEqual(shows[0].title, "Legacy Show")
+        self.assertEqual(list(shows[0].episodes.items()), [
+            (3, ""),
+            (1, datetime.date(2026, 9, 1)),
+            (2, datetime.date(2026, 9, 8)),
+            (0, datetime.date(2026, 9, 20))
+            ])
+
+if __name__ == "__main__":
+    unittest.main()